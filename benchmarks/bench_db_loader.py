@@ -0,0 +1,81 @@
+"""
+Staging table load time: DBInserter.insert_analyzed_comments_staging
+(pandas + execute_values) against copy_analyzed_comments_staging (COPY).
+
+Needs a reachable PostgreSQL; the staging table is dropped before each run
+and recreated by the loader, so do not point it at a database you care about.
+
+    python benchmarks/bench_db_loader.py --rows 100000 --host localhost
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "dags"))
+
+from db_inserter import DBInserter  # noqa: E402
+
+SAMPLE_CSV = os.path.join(
+    os.path.dirname(__file__), "..", "dags", "analyzed_journaling_comments.csv"
+)
+
+
+def make_csv(path, rows):
+    """Blow the sample analyzed comments up to rows rows with unique hashes"""
+    sample = pd.read_csv(SAMPLE_CSV)
+    df = sample.sample(n=rows, replace=True, random_state=0).reset_index(drop=True)
+    df["comment_hash"] = [
+        hashlib.sha256(str(i).encode("utf-8")).hexdigest() for i in range(rows)
+    ]
+    df.to_csv(path, index=False)
+
+
+def drop_staging_table(db_inserter):
+    conn = db_inserter._get_connection()
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS analyzed_comments_staging")
+    conn.commit()
+    cur.close()
+    db_inserter._release_connection(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dbname", default="airflow")
+    parser.add_argument("--user", default="airflow")
+    parser.add_argument("--password", default="airflow")
+    parser.add_argument("--host", default="localhost")
+    args = parser.parse_args()
+
+    db_inserter = DBInserter(
+        dbname=args.dbname, user=args.user, password=args.password, host=args.host
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "comments.csv")
+        make_csv(csv_path, args.rows)
+        size_mb = os.path.getsize(csv_path) / 1e6
+        print(f"{args.rows} rows, {size_mb:.1f} MB CSV")
+
+        for name, load in [
+            ("execute_values", db_inserter.insert_analyzed_comments_staging),
+            ("COPY", db_inserter.copy_analyzed_comments_staging),
+        ]:
+            drop_staging_table(db_inserter)
+            started_at = time.perf_counter()
+            load(csv_path)
+            elapsed = time.perf_counter() - started_at
+            print(f"{name:>15}: {elapsed:.2f}s ({args.rows / elapsed:,.0f} rows/s)")
+
+        drop_staging_table(db_inserter)
+
+
+if __name__ == "__main__":
+    main()
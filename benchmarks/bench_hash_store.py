@@ -0,0 +1,78 @@
+"""
+Dedup cost per scrape as history grows: the old CSV-as-database path
+(read the whole CSV, build a set, rewrite the file) against HashStore.
+
+    python benchmarks/bench_hash_store.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "dags"))
+
+from hash_store import HashStore  # noqa: E402
+
+
+def make_comments(start, count):
+    return [
+        {
+            "comment_hash": hashlib.sha256(str(i).encode("utf-8")).hexdigest(),
+            "subreddit": "journaling",
+            "content": f"comment {i}",
+        }
+        for i in range(start, start + count)
+    ]
+
+
+def csv_dedup(csv_path, new_comments):
+    existing_df = pd.read_csv(csv_path)
+    existing_hashes = set(existing_df["comment_hash"].values)
+    unique = [c for c in new_comments if c["comment_hash"] not in existing_hashes]
+    df = pd.concat([existing_df, pd.DataFrame(unique)], ignore_index=True)
+    df.to_csv(csv_path, index=False)
+
+
+def store_dedup(hash_store, csv_path, new_comments):
+    unique = hash_store.filter_new(new_comments)
+    pd.DataFrame(unique).to_csv(csv_path, mode="a", header=False, index=False)
+    hash_store.add(unique)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--new", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'history':>10} {'csv (s)':>10} {'hash store (s)':>15}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            history = make_comments(0, size)
+            # Half of each scrape is already known, as on a typical re-run
+            new_comments = make_comments(size - args.new // 2, args.new)
+
+            csv_path = os.path.join(tmp, f"csv_{size}.csv")
+            pd.DataFrame(history).to_csv(csv_path, index=False)
+            started_at = time.perf_counter()
+            csv_dedup(csv_path, new_comments)
+            csv_seconds = time.perf_counter() - started_at
+
+            store_csv_path = os.path.join(tmp, f"store_{size}.csv")
+            pd.DataFrame(history).to_csv(store_csv_path, index=False)
+            hash_store = HashStore(os.path.join(tmp, f"hashes_{size}.sqlite3"))
+            hash_store.add(history)
+            started_at = time.perf_counter()
+            store_dedup(hash_store, store_csv_path, new_comments)
+            store_seconds = time.perf_counter() - started_at
+
+            print(f"{size:>10} {csv_seconds:>10.3f} {store_seconds:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
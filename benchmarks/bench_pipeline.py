@@ -0,0 +1,325 @@
+"""
+End-to-end pipeline benchmark against the local stand-ins in fakes.py:
+
+- scrape: RedditScraper.scrape_subreddits over ReplayReddit, saving with
+  save_new_comments; latency from comment tree request to delivery
+- analyze: LLMAnalyzer.analyze_dataframe against FakeLLMServer; latency
+  of each analyze_post / analyze_batch call
+- load: DBInserter COPY into staging in batches plus the merge; latency per
+  batch. Only runs with --host, and writes the synthetic comments to the
+  analyzed_comments tables, so point it at a scratch database
+- miro: MiroBoardManager.create_sticky_notes against FakeMiroServer's rate
+  limit; latency per chunk of notes, including 429 retries
+
+Stages run in this order and each reads the files the previous ones wrote,
+so --stages can drop trailing stages (or load) but not earlier ones.
+
+Each stage reports rows/sec, p50/p95/p99 latency and peak memory traced by
+tracemalloc (which slows Python-heavy code; --no-trace-memory turns it
+off). --metrics saves the counters and spans the pipeline recorded, in
+the Prometheus text format. Service URLs and state files point at the
+fakes and a temporary directory. Rate limits default to values that keep
+the pipeline, not the production quotas, the bottleneck; export
+LLM_REQUESTS_PER_MINUTE etc. to benchmark under other limits.
+
+    python benchmarks/bench_pipeline.py --comments 1000
+    python benchmarks/bench_pipeline.py --output baseline.json
+    python benchmarks/bench_pipeline.py --baseline baseline.json
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "dags"))
+
+from fakes import (  # noqa: E402
+    FakeLLMServer,
+    FakeMiroServer,
+    ReplayReddit,
+    load_recorded_comments,
+    synthesize_comments,
+)
+from db_inserter import DBInserter  # noqa: E402
+from hash_store import HashStore  # noqa: E402
+from instrumentation import LOGGER_NAME, get_metrics  # noqa: E402
+from list_fields import decode_list  # noqa: E402
+from llm_analyzer import LLMAnalyzer  # noqa: E402
+from miro_integration import MiroBoardManager  # noqa: E402
+from reddit_scraper import RedditScraper, save_new_comments  # noqa: E402
+
+STAGES = ["scrape", "analyze", "load", "miro"]
+
+# Generous client-side limits; exported values take precedence
+BENCHMARK_LIMITS = {
+    "REDDIT_REQUESTS_PER_MINUTE": "60000",
+    "LLM_REQUESTS_PER_MINUTE": "60000",
+    "LLM_TOKENS_PER_MINUTE": "100000000",
+    "LLM_MAX_CONCURRENCY": "16",
+    "LLM_MAX_WORKERS": "16",
+}
+
+
+def timed(obj, name, latencies):
+    """Record the duration of every call of obj.name into latencies"""
+    method = getattr(obj, name)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started_at)
+
+    setattr(obj, name, wrapper)
+
+
+def run_stage(name, stage, trace_memory, verbose):
+    """
+    Run stage(latencies) -> rows processed and measure it.
+
+    Returns:
+        dict: rows, seconds, rows_per_sec, p50/p95/p99 latency in ms and
+        peak_mb (None without tracing)
+    """
+    latencies = []
+    if trace_memory:
+        tracemalloc.start()
+    started_at = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+            rows = stage(latencies)
+    seconds = time.perf_counter() - started_at
+    peak_mb = None
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+
+    result = {
+        "stage": name,
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds, 1) if seconds else 0.0,
+        "peak_mb": round(peak_mb, 1) if peak_mb is not None else None,
+    }
+    for percentile in (50, 95, 99):
+        result[f"p{percentile}_ms"] = (
+            round(float(np.percentile(latencies, percentile)) * 1000, 1)
+            if latencies
+            else None
+        )
+    return result
+
+
+def scrape_stage(comments, args):
+    def stage(latencies):
+        reddit = ReplayReddit(comments, latency=args.reddit_latency)
+        scraper = RedditScraper(reddit_factory=lambda: reddit)
+        hash_store = HashStore()
+        delivered = set()
+        rows = 0
+        buffer = []
+        configs = [
+            {"name": name, "hot_limit": 1000, "new_limit": 1000}
+            for name in sorted(reddit.subreddits)
+        ]
+        for comment in scraper.scrape_subreddits(configs):
+            if comment["post_hash"] not in delivered:
+                delivered.add(comment["post_hash"])
+                latencies.append(
+                    time.perf_counter() - reddit.requested_at[comment["post_hash"]]
+                )
+            buffer.append(comment)
+            rows += 1
+            if len(buffer) >= 500:
+                save_new_comments(hash_store, buffer)
+                buffer = []
+        save_new_comments(hash_store, buffer)
+        scraper.state.flush()
+
+        # One CSV for the analysis stage, like the DAG's per-subreddit files
+        pd.concat(
+            [pd.read_csv(f"reddit_comments_{config['name']}.csv") for config in configs]
+        ).to_csv("comments.csv", index=False)
+        return rows
+
+    return stage
+
+
+def analyze_stage(latencies):
+    analyzer = LLMAnalyzer()
+    timed(analyzer, "analyze_post", latencies)
+    timed(analyzer, "analyze_batch", latencies)
+    analyzer.analyze_dataframe("comments.csv")
+    return len(pd.read_csv("comments.csv", usecols=["comment_hash"]))
+
+
+def load_stage(args):
+    def stage(latencies):
+        db_inserter = DBInserter(
+            dbname=args.dbname, user=args.user, password=args.password, host=args.host
+        )
+        timed(db_inserter, "copy_analyzed_comments_staging", latencies)
+        timed(db_inserter, "merge_staging_to_main", latencies)
+        rows = 0
+        for chunk in pd.read_csv("comments-staging.csv", chunksize=args.db_batch):
+            db_inserter.copy_analyzed_comments_staging(chunk.to_dict("records"))
+            rows += len(chunk)
+        db_inserter.merge_staging_to_main()
+        return rows
+
+    return stage
+
+
+def miro_stage(latencies):
+    manager = MiroBoardManager()
+    timed(manager, "_create_chunk", latencies)
+    df = pd.read_csv("comments-staging.csv")
+    notes = []
+    for comment_hash, value in zip(df["comment_hash"], df["pain_points"]):
+        for position, item in enumerate(decode_list(value)):
+            i = len(notes)
+            notes.append(
+                {
+                    "key": f"{comment_hash}:{position}",
+                    "text": item,
+                    "x": (i % 50) * 220,
+                    "y": (i // 50) * 220,
+                }
+            )
+    board_id = manager.create_board("Pipeline benchmark")
+    created, _ = manager.create_sticky_notes(board_id, notes)
+    return len(created)
+
+
+def print_report(results, baseline=None):
+    baseline = {result["stage"]: result for result in baseline or []}
+    columns = ["rows", "seconds", "rows_per_sec", "p50_ms", "p95_ms", "p99_ms"]
+    columns.append("peak_mb")
+    print(f"{'stage':>8} " + " ".join(f"{column:>12}" for column in columns))
+    for result in results:
+        print(
+            f"{result['stage']:>8} "
+            + " ".join(f"{str(result[column]):>12}" for column in columns)
+        )
+        before = baseline.get(result["stage"])
+        if not before:
+            continue
+        changes = []
+        for column in ["rows_per_sec", "p95_ms", "peak_mb"]:
+            if before.get(column) and result.get(column) is not None:
+                change = (result[column] - before[column]) / before[column]
+                changes.append(f"{column} {change:+.0%}")
+        print(f"{'':>8} vs baseline: {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--comments", type=int, default=1000)
+    parser.add_argument("--subreddits", type=int, default=4)
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--reddit-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=1000)
+    parser.add_argument("--miro-requests-per-second", type=int, default=20)
+    parser.add_argument("--miro-latency", type=float, default=0.1)
+    parser.add_argument("--host", help="PostgreSQL host for the load stage")
+    parser.add_argument("--dbname", default="airflow")
+    parser.add_argument("--user", default="airflow")
+    parser.add_argument("--password", default="airflow")
+    parser.add_argument("--db-batch", type=int, default=1000)
+    parser.add_argument("--no-trace-memory", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--metrics", help="Write the pipeline's metrics to this file")
+    parser.add_argument("--output", help="Save the results as JSON")
+    parser.add_argument("--baseline", help="Compare with results saved by --output")
+    args = parser.parse_args()
+    stages = [stage for stage in args.stages.split(",") if stage]
+    if not args.verbose:
+        logging.getLogger(LOGGER_NAME).setLevel(logging.WARNING)
+
+    comments = synthesize_comments(
+        load_recorded_comments(), args.comments, subreddits=args.subreddits
+    )
+    llm = FakeLLMServer(
+        comments,
+        latency=args.llm_latency,
+        tokens_per_second=args.llm_tokens_per_second,
+    ).start()
+    miro = FakeMiroServer(
+        requests_per_second=args.miro_requests_per_second, latency=args.miro_latency
+    ).start()
+
+    workdir = tempfile.TemporaryDirectory()
+    for name, value in BENCHMARK_LIMITS.items():
+        os.environ.setdefault(name, value)
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.update(
+        {
+            "LLM_BASE_URL": llm.url,
+            "MIRO_BASE_URL": miro.url,
+            "LLM_CACHE_PATH": os.path.join(workdir.name, "llm_cache.sqlite3"),
+            "NEAR_DUP_INDEX_PATH": os.path.join(workdir.name, "near_dup.sqlite3"),
+            "HASH_STORE_PATH": os.path.join(workdir.name, "hashes.sqlite3"),
+            "SCRAPE_STATE_PATH": os.path.join(workdir.name, "scrape.sqlite3"),
+            "MIRO_PROGRESS_DIR": os.path.join(workdir.name, "miro_progress"),
+        }
+    )
+
+    planned = {
+        "scrape": scrape_stage(comments, args),
+        "analyze": analyze_stage,
+        "load": load_stage(args) if args.host else None,
+        "miro": miro_stage,
+    }
+    cwd = os.getcwd()
+    os.chdir(workdir.name)
+    results = []
+    try:
+        for name in STAGES:
+            if name not in stages:
+                continue
+            if planned[name] is None:
+                print(f"Skipping {name} (no --host given)")
+                continue
+            results.append(
+                run_stage(name, planned[name], not args.no_trace_memory, args.verbose)
+            )
+    finally:
+        os.chdir(cwd)
+        llm.stop()
+        miro.stop()
+        workdir.cleanup()
+
+    print(
+        f"{args.comments} comments; fake LLM served {llm.stats.get('requests', 0)} "
+        f"requests, fake Miro throttled {miro.stats.get('throttled', 0)}"
+    )
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            f.write(get_metrics().prometheus_text())
+
+
+if __name__ == "__main__":
+    main()
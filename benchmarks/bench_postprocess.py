@@ -0,0 +1,125 @@
+"""
+Post-processing overhead of analysis results per 10k rows: the old per-row
+path (five df.at writes per result, iterrows + split(",") to explode list
+fields) against AnalysisResults and explode_list_fields.
+
+    python benchmarks/bench_postprocess.py --rows 10000 50000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "dags"))
+
+from list_fields import explode_list_fields  # noqa: E402
+from llm_analyzer import AnalysisResults  # noqa: E402
+
+
+def make_frame(rows):
+    df = pd.DataFrame(
+        {
+            "comment_hash": [f"{i:064x}" for i in range(rows)],
+            "content": [f"comment {i}" for i in range(rows)],
+            "scanned": "N",
+        }
+    )
+    # Analysis columns as analyze_dataframe adds them
+    for field in ["pain_points", "gain_points", "jobs_to_be_done", "themes"]:
+        df[field] = pd.Series(dtype="str")
+    df["relevance_score"] = pd.Series(dtype="float64")
+    return df
+
+
+def make_analysis(i):
+    if i % 10 == 0:
+        return None
+    return {
+        "pain_points": [f"pain {i % 50}", "slow, laggy sync"],
+        "gain_points": [f"gain {i % 30}"],
+        "jobs_to_be_done": [f"job {i % 20}", "reflect daily"],
+        "themes": ["sync", f"theme {i % 40}"],
+        "relevance_score": (i % 10) / 10,
+    }
+
+
+def per_row_assign(df, analyses):
+    for idx, analysis in zip(df.index, analyses):
+        if analysis:
+            df.at[idx, "pain_points"] = ", ".join(analysis["pain_points"])
+            df.at[idx, "gain_points"] = ", ".join(analysis["gain_points"])
+            df.at[idx, "jobs_to_be_done"] = ", ".join(analysis["jobs_to_be_done"])
+            df.at[idx, "themes"] = ", ".join(analysis["themes"])
+            df.at[idx, "relevance_score"] = analysis["relevance_score"]
+        else:
+            df.at[idx, "pain_points"] = ""
+            df.at[idx, "gain_points"] = ""
+            df.at[idx, "jobs_to_be_done"] = ""
+            df.at[idx, "themes"] = ""
+            df.at[idx, "relevance_score"] = 0.1
+        df.at[idx, "scanned"] = "Y"
+    return df[df["relevance_score"] >= 0.5]
+
+
+def per_row_explode(df):
+    rows = []
+    for _, row in df.iterrows():
+        for field in ["pain_points", "gain_points", "jobs_to_be_done", "themes"]:
+            if row[field]:
+                for position, item in enumerate(row[field].split(","), 1):
+                    rows.append((row["comment_hash"], field, position, item.strip()))
+    return rows
+
+
+def buffered_assign(df, analyses):
+    results = AnalysisResults()
+    for idx, analysis in zip(df.index, analyses):
+        results.add(idx, analysis)
+    results.apply(df)
+    relevance = pd.to_numeric(df["relevance_score"], errors="coerce")
+    return df[relevance >= 0.5]
+
+
+def timed(fn, *args):
+    started_at = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started_at, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000])
+    args = parser.parse_args()
+
+    print(
+        f"{'rows':>8} {'stage':>8} {'per-row (ms/10k)':>18} "
+        f"{'vectorized (ms/10k)':>20} {'speedup':>8}"
+    )
+    for rows in args.rows:
+        analyses = [make_analysis(i) for i in range(rows)]
+
+        old_assign, old_filtered = timed(per_row_assign, make_frame(rows), analyses)
+        new_assign, new_filtered = timed(buffered_assign, make_frame(rows), analyses)
+        assert len(old_filtered) == len(new_filtered)
+
+        old_explode, old_items = timed(per_row_explode, old_filtered)
+        new_explode, new_items = timed(explode_list_fields, new_filtered)
+
+        scale = 10000 / rows * 1000
+        for stage, old, new in [
+            ("assign", old_assign, new_assign),
+            ("explode", old_explode, new_explode),
+        ]:
+            print(
+                f"{rows:>8} {stage:>8} {old * scale:>18.1f} "
+                f"{new * scale:>20.1f} {old / new:>7.1f}x"
+            )
+        # The old path splits "slow, laggy sync" into two items
+        print(f"{'':>8} {'items':>8} {len(old_items):>18} {len(new_items):>20}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Throughput of the CPU-bound preprocessing stage (hash, markdown cleanup,
+token count) run inline against the process pool, over synthetic comments
+recombined from the recorded ones. The pool only pays off with several
+cores; on one core it measures the cost of shipping chunks to a worker.
+
+    python benchmarks/bench_preprocessing.py --comments 200000 --workers 1 2 4
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "dags"))
+
+from fakes import load_recorded_comments, synthesize_comments  # noqa: E402
+from preprocessing import Preprocessor  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--comments", type=int, default=100000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    contents = pd.Series(
+        [
+            comment["body"]
+            for comment in synthesize_comments(load_recorded_comments(), args.comments)
+        ]
+    )
+    print(f"{len(contents)} comments, {contents.str.len().mean():.0f} chars on average")
+    print(f"{'workers':>8} {'best (s)':>10} {'rows/sec':>12}")
+    expected = None
+    for workers in args.workers:
+        preprocessor = Preprocessor(
+            max_workers=workers, chunk_size=args.chunk_size, min_rows=0
+        )
+        timings = []
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            prepared = preprocessor.preprocess(contents)
+            timings.append(time.perf_counter() - started_at)
+        preprocessor.shutdown()
+
+        # Every configuration must produce the same records
+        if expected is None:
+            expected = prepared
+        pd.testing.assert_frame_equal(prepared, expected)
+        best = min(timings)
+        print(f"{workers:>8} {best:>10.3f} {len(contents) / best:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""
+Local stand-ins for the services the pipeline talks to, for benchmarks:
+
+- ReplayReddit: praw.Reddit-like client replaying recorded comments
+- FakeLLMServer: OpenAI-compatible chat completions endpoint with simulated
+  latency and token usage, answering with the recorded analyses
+- FakeMiroServer: Miro REST endpoints with a per-second rate limit that
+  answers 429 with Retry-After once exceeded
+
+Comments and analyses are seeded from analyzed_journaling_comments.csv.
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "dags"))
+
+from list_fields import LIST_FIELDS, decode_list  # noqa: E402
+
+SAMPLE_CSV = os.path.join(
+    os.path.dirname(__file__), "..", "dags", "analyzed_journaling_comments.csv"
+)
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+SINGLE_CONTENT_PATTERN = re.compile(
+    r"Content: (.*?)\n\s*\n\s*Format your response", re.DOTALL
+)
+BATCH_COMMENTS_PATTERN = re.compile(
+    r"Comments:\n(.*?)\n\s*\n\s*Format your response", re.DOTALL
+)
+BATCH_ID_PATTERN = re.compile(r"^\s*\[([0-9a-f]+)\] ", re.MULTILINE)
+
+
+def simulated_latency(median, rng=random):
+    """Log-normal delay around median seconds, for realistic tail latencies"""
+    if median <= 0:
+        return 0.0
+    return median * math.exp(rng.gauss(0, 0.5))
+
+
+def load_recorded_comments(path=SAMPLE_CSV):
+    """Recorded comments with their analysis dicts"""
+    df = pd.read_csv(path)
+    df = df[df["content"].notna()].reset_index(drop=True)
+    analyses = []
+    for _, row in df.iterrows():
+        analysis = {field: decode_list(row.get(field)) for field in LIST_FIELDS}
+        score = row.get("relevance_score")
+        analysis["relevance_score"] = 0.1 if pd.isna(score) else float(score)
+        analyses.append(analysis)
+    df["analysis"] = analyses
+    return df
+
+
+def synthesize_comments(
+    recorded, count, subreddits=4, comments_per_submission=25, seed=0
+):
+    """
+    Recorded comments first, then new comments recombined from their
+    sentences until count comments exist. Synthetic comments are distinct
+    texts (not near duplicates of one another) and take the analysis of the
+    comment their first sentence came from.
+
+    Returns:
+        list: Comment dicts (id, body, analysis, subreddit, submission,
+        created_utc), spread over subreddits and submissions
+    """
+    rng = random.Random(seed)
+    sentences = []
+    for body, analysis in zip(recorded["content"], recorded["analysis"]):
+        for sentence in SENTENCE_PATTERN.split(str(body)):
+            if len(sentence.split()) >= 4:
+                sentences.append((sentence.strip(), analysis))
+
+    comments = []
+    seen = set()
+    sources = list(zip(recorded["content"], recorded["analysis"]))
+    while len(comments) < count:
+        if sources:
+            body, analysis = sources.pop(0)
+        else:
+            picked = rng.sample(sentences, min(len(sentences), rng.randint(2, 4)))
+            body = " ".join(sentence for sentence, _ in picked)
+            analysis = picked[0][1]
+        if body in seen:
+            continue
+        seen.add(body)
+        i = len(comments)
+        submission = i // comments_per_submission
+        comments.append(
+            {
+                "id": f"b{i}",
+                "body": body,
+                "analysis": analysis,
+                "subreddit": f"bench{submission % subreddits}",
+                "submission": submission,
+                "created_utc": 1700000000 + i,
+            }
+        )
+    return comments
+
+
+class _Author:
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, other):
+        # praw compares Redditors with names case-insensitively
+        other = getattr(other, "name", other)
+        return str(other).lower() == self.name.lower()
+
+    def __hash__(self):
+        return hash(self.name.lower())
+
+
+class _Comment:
+    def __init__(self, comment, submission_id):
+        self.id = comment["id"]
+        self.body = comment["body"]
+        self.author = _Author(f"user{hash(comment['id']) % 1000}")
+        self.created_utc = comment["created_utc"]
+        self.score = 1
+        self.permalink = f"/r/{comment['subreddit']}/comments/{submission_id}/"
+        self.parent_id = f"t3_{submission_id}"
+        self.is_submitter = False
+
+
+class _CommentForest:
+    def __init__(self, reddit, submission, comments):
+        self.reddit = reddit
+        self.submission = submission
+        self.comments = comments
+
+    def replace_more(self, limit=0):
+        # The comment tree request
+        self.reddit.request(self.submission)
+
+    def list(self):
+        return list(self.comments)
+
+
+class _Submission:
+    def __init__(self, reddit, submission_id, comments):
+        self.id = submission_id
+        self.title = f"Recorded thread {submission_id}"
+        self.selftext = ""
+        self.num_comments = len(comments)
+        self.created_utc = max(comment.created_utc for comment in comments)
+        self.post_hash = hashlib.sha256(self.title.encode("utf-8")).hexdigest()
+        self.comments = _CommentForest(reddit, self, comments)
+
+
+class _Subreddit:
+    def __init__(self, reddit, submissions):
+        self.reddit = reddit
+        self.submissions = submissions
+
+    def _listing(self, submissions, limit):
+        # Listings are fetched in pages of up to 100 submissions
+        for start in range(0, min(limit, len(submissions)), 100):
+            self.reddit.request()
+            yield from submissions[start : min(start + 100, limit)]
+
+    def hot(self, limit=10):
+        return self._listing(self.submissions[0::2], limit)
+
+    def new(self, limit=25):
+        # Newest first, like Reddit's new listing
+        submissions = sorted(
+            self.submissions[1::2], key=lambda s: s.created_utc, reverse=True
+        )
+        return self._listing(submissions, limit)
+
+
+class ReplayReddit:
+    """
+    praw.Reddit stand-in serving comments from synthesize_comments(). Every
+    listing page and comment tree costs one simulated request.
+
+    requested_at maps a submission's post_hash to the time its comment tree
+    was requested, so a consumer can measure submission-to-delivery latency.
+    """
+
+    read_only = True
+
+    def __init__(self, comments, latency=0.05, seed=0):
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.requested_at = {}
+        self.config = type("Config", (), {"user_agent": "benchmark replay"})()
+        self.user = type("User", (), {"me": staticmethod(lambda: None)})()
+
+        by_subreddit = {}
+        for comment in comments:
+            submissions = by_subreddit.setdefault(comment["subreddit"], {})
+            submissions.setdefault(comment["submission"], []).append(comment)
+        self.subreddits = {}
+        for name, submissions in by_subreddit.items():
+            self.subreddits[name] = [
+                _Submission(
+                    self,
+                    f"s{number}",
+                    [_Comment(comment, f"s{number}") for comment in members],
+                )
+                for number, members in submissions.items()
+            ]
+
+    def request(self, submission=None):
+        with self.lock:
+            self.requests += 1
+            delay = simulated_latency(self.latency, self.rng)
+            if submission is not None:
+                self.requested_at[submission.post_hash] = time.perf_counter()
+        time.sleep(delay)
+
+    def subreddit(self, name):
+        return _Subreddit(self, self.subreddits.get(name, []))
+
+
+class _FakeServer:
+    """ThreadingHTTPServer on a free local port, served from a daemon thread"""
+
+    def __init__(self, handler):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.fake = self
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.lock = threading.Lock()
+        self.rng = random.Random(0)
+        self.stats = {}
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + amount
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def reply(self, status, body, headers=()):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _LLMHandler(_JSONHandler):
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.read_json()
+        prompt = body["messages"][0]["content"]
+
+        batch = BATCH_COMMENTS_PATTERN.search(prompt)
+        if batch:
+            parts = BATCH_ID_PATTERN.split(batch.group(1))
+            results = [
+                dict(fake.analysis_for(content), id=item_id)
+                for item_id, content in zip(parts[1::2], parts[2::2])
+            ]
+            content = json.dumps({"results": results})
+        else:
+            single = SINGLE_CONTENT_PATTERN.search(prompt)
+            comment = single.group(1) if single else prompt
+            content = "```json\n" + json.dumps(fake.analysis_for(comment)) + "\n```"
+
+        prompt_tokens = len(prompt) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        with fake.lock:
+            delay = simulated_latency(fake.latency, fake.rng)
+        time.sleep(delay + completion_tokens / fake.tokens_per_second)
+        fake.count("requests")
+        fake.count("prompt_tokens", prompt_tokens)
+        fake.count("completion_tokens", completion_tokens)
+        self.reply(
+            200,
+            {
+                "id": "bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "bench"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+
+class FakeLLMServer(_FakeServer):
+    """
+    OpenAI-compatible /chat/completions answering single and batched
+    analysis prompts with the recorded analysis of each comment. Each
+    response takes a log-normal latency around `latency` seconds plus the
+    time to generate its completion at tokens_per_second.
+    """
+
+    def __init__(self, comments, latency=0.5, tokens_per_second=200):
+        super().__init__(_LLMHandler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.analyses = {
+            comment["body"].strip(): comment["analysis"] for comment in comments
+        }
+
+    def analysis_for(self, content):
+        analysis = self.analyses.get(content.strip())
+        if analysis is None:
+            analysis = {field: [] for field in LIST_FIELDS}
+            analysis["relevance_score"] = 0.1
+        return analysis
+
+
+class _MiroHandler(_JSONHandler):
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.read_json()
+        retry_after = fake.throttle()
+        if retry_after:
+            fake.count("throttled")
+            return self.reply(
+                429, {"message": "Too many requests"}, [("Retry-After", retry_after)]
+            )
+        with fake.lock:
+            delay = simulated_latency(fake.latency, fake.rng)
+        time.sleep(delay)
+
+        if self.path.endswith("/boards"):
+            fake.count("boards")
+            return self.reply(201, {"id": f"board{fake.next_id()}"})
+        if self.path.endswith("/items/bulk"):
+            fake.count("items", len(body))
+            return self.reply(
+                201,
+                {"type": "bulk-list", "data": [{"id": fake.next_id()} for _ in body]},
+            )
+        if self.path.endswith("/sticky_notes"):
+            fake.count("items")
+            return self.reply(201, {"id": fake.next_id()})
+        self.reply(404, {"message": "Not found"})
+
+
+class FakeMiroServer(_FakeServer):
+    """
+    Miro board, sticky note and bulk item endpoints. Requests beyond
+    requests_per_second in the current one-second window get a 429 with a
+    Retry-After header, like Miro's rate limiter.
+    """
+
+    def __init__(self, requests_per_second=20, latency=0.1):
+        super().__init__(_MiroHandler)
+        self.requests_per_second = requests_per_second
+        self.latency = latency
+        self.window = (0, 0)
+        self.ids = 0
+
+    def next_id(self):
+        with self.lock:
+            self.ids += 1
+            return str(self.ids)
+
+    def throttle(self):
+        """None when the request is allowed, else the Retry-After value"""
+        now = time.monotonic()
+        with self.lock:
+            second, used = self.window
+            if int(now) != second:
+                second, used = int(now), 0
+            used += 1
+            self.window = (second, used)
+            if used > self.requests_per_second:
+                return "1"
+        return None
@@ -0,0 +1,109 @@
+import os
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def artifact_dir(run_id, task_id):
+    """Run-scoped directory for a task's artifacts under ARTIFACT_ROOT"""
+    root = os.getenv("ARTIFACT_ROOT", "artifacts")
+    # Airflow run ids contain characters like ':' and '+'
+    safe_run_id = re.sub(r"[^A-Za-z0-9_.-]", "_", run_id)
+    path = os.path.abspath(os.path.join(root, safe_run_id, task_id))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _manifest(path, rows, schema):
+    return {
+        "path": path,
+        "format": "parquet",
+        "rows": rows,
+        "columns": schema.names,
+        "bytes": os.path.getsize(path),
+    }
+
+
+def write_artifact(df, run_id, task_id, name="data"):
+    """
+    Write df as a Parquet file in the task's run-scoped directory.
+
+    The file is written under a temporary name and renamed into place, so a
+    retried task never leaves a half-written artifact behind.
+
+    Returns:
+        dict: Manifest (path, format, rows, columns, bytes), small enough to
+        pass between tasks through XCom
+    """
+    path = os.path.join(artifact_dir(run_id, task_id), f"{name}.parquet")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return _manifest(path, table.num_rows, table.schema)
+
+
+def write_records(records, run_id, task_id, name="data", batch_size=1000):
+    """
+    Stream an iterable of dicts into a Parquet artifact batch by batch, so
+    the records are never all held in memory. All records must share the
+    keys of the first one.
+
+    Returns:
+        dict: Manifest as for write_artifact, or None when there were no records
+    """
+    path = os.path.join(artifact_dir(run_id, task_id), f"{name}.parquet")
+    writer = None
+    rows = 0
+    batch = []
+
+    def flush():
+        nonlocal writer
+        table = pa.Table.from_pandas(pd.DataFrame(batch), preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(path + ".tmp", table.schema)
+        else:
+            table = table.cast(writer.schema)
+        writer.write_table(table)
+
+    try:
+        for record in records:
+            batch.append(record)
+            rows += 1
+            if len(batch) >= batch_size:
+                flush()
+                batch = []
+        if batch:
+            flush()
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        return None
+    os.replace(path + ".tmp", path)
+    return _manifest(path, rows, pq.read_schema(path))
+
+
+def read_artifact(manifest, columns=None):
+    """
+    Load an artifact as a DataFrame, memory-mapping the file and reading only
+    the requested columns. An empty or missing manifest gives an empty frame.
+    """
+    if not manifest:
+        return pd.DataFrame(columns=columns)
+    table = pq.read_table(manifest["path"], columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def iter_artifact_batches(manifest, batch_size=1000, columns=None):
+    """Lazily yield an artifact as DataFrames of up to batch_size rows"""
+    if not manifest:
+        return
+    parquet_file = pq.ParquetFile(manifest["path"], memory_map=True)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
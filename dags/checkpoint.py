@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+
+
+class CheckpointJournal:
+    """
+    Append-only JSONL log of analysis results, one line per comment.
+
+    Results are appended as they land instead of rewriting the whole CSV, and
+    a restarted run replays the log to resume where the previous one stopped.
+    Failures are logged as None but not replayed, so the resumed run retries
+    the comments that failed, e.g. during an outage or a burst of 429s.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    @classmethod
+    def for_csv(cls, csv_path):
+        """Journal stored next to csv_path, e.g. comments.csv -> comments.journal.jsonl"""
+        return cls(csv_path.rsplit(".", 1)[0] + ".journal.jsonl")
+
+    def load(self):
+        """
+        Replay the journal.
+
+        Returns:
+            dict: comment_hash -> analysis of every comment that succeeded.
+            Failed analyses and a torn last line from an interrupted run are
+            left out.
+        """
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry["analysis"] is None:
+                    continue
+                results[entry["comment_hash"]] = entry["analysis"]
+        return results
+
+    def append(self, comment_hash, analysis):
+        """Record one result and flush it to the OS"""
+        line = json.dumps({"comment_hash": comment_hash, "analysis": analysis})
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a", encoding="utf-8")
+                # Terminate a torn last line so it can't swallow this entry
+                if self.file.tell() and not self._ends_with_newline():
+                    self.file.write("\n")
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
+
+    def discard(self):
+        """Delete the journal once its results are materialized in the CSV"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
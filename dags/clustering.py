@@ -0,0 +1,254 @@
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+STOP_WORDS = frozenset(
+    """
+    a an and are as at be but by can do for from have how i in into is it its
+    me my not of on or so that the their them they this to too was we what
+    when with you your
+    """.split()
+)
+
+# Rows of the k-means similarity matrix computed at once, to bound memory
+ASSIGN_CHUNK_SIZE = 4096
+
+
+def vector_dimensions():
+    return int(os.getenv("CLUSTER_DIMENSIONS", "512"))
+
+
+def normalize_item(item):
+    """Key used to treat differently cased / spaced copies as the same item"""
+    return " ".join(str(item).lower().split())
+
+
+def tokenize(text):
+    """Lower-cased words without stop words, plus adjacent word pairs"""
+    words = [w for w in TOKEN_PATTERN.findall(text.lower()) if w not in STOP_WORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+_feature_cache = {}
+
+
+def _feature(token, dimensions):
+    """Stable (index, sign) of a token; Python's hash() is salted per process"""
+    key = (token, dimensions)
+    feature = _feature_cache.get(key)
+    if feature is None:
+        digest = int.from_bytes(
+            hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little"
+        )
+        feature = (digest % dimensions, 1.0 if digest >> 63 else -1.0)
+        _feature_cache[key] = feature
+    return feature
+
+
+def vectorize(items, dimensions=None, idf=True):
+    """
+    TF-IDF vectors of items, folded into a fixed number of dimensions with
+    signed feature hashing. The vocabulary is never materialized, so memory
+    is O(len(items) * dimensions) and vectors from different runs share the
+    same space. With idf=False the weights depend on each item alone, which
+    keeps vectors comparable between a training set and later batches.
+
+    Returns:
+        np.ndarray: float32 matrix of L2-normalized rows (all-zero for items
+        without any usable token)
+    """
+    dimensions = dimensions or vector_dimensions()
+    token_counts = [Counter(tokenize(item)) for item in items]
+
+    document_frequency = Counter()
+    for counts in token_counts:
+        document_frequency.update(counts.keys())
+    n = len(items)
+
+    vectors = np.zeros((n, dimensions), dtype=np.float32)
+    for row, counts in enumerate(token_counts):
+        for token, count in counts.items():
+            index, sign = _feature(token, dimensions)
+            weight = 1 + math.log(count)
+            if idf:
+                weight *= math.log((1 + n) / (1 + document_frequency[token])) + 1
+            vectors[row, index] += sign * weight
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def _assign(vectors, centroids):
+    """Index of and cosine similarity to the nearest centroid for every row"""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    similarities = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+        scores = vectors[start : start + ASSIGN_CHUNK_SIZE] @ centroids.T
+        labels[start : start + len(scores)] = scores.argmax(axis=1)
+        similarities[start : start + len(scores)] = scores.max(axis=1)
+    return labels, similarities
+
+
+def _init_centroids(vectors, k, rng):
+    """k-means++ seeding on cosine distance"""
+    centroids = np.empty((k, vectors.shape[1]), dtype=np.float32)
+    centroids[0] = vectors[rng.integers(len(vectors))]
+    distances = 1 - vectors @ centroids[0]
+    for i in range(1, k):
+        weights = np.clip(distances, 0, None) ** 2
+        total = weights.sum()
+        if total > 0:
+            choice = rng.choice(len(vectors), p=weights / total)
+        else:
+            choice = rng.integers(len(vectors))
+        centroids[i] = vectors[choice]
+        distances = np.minimum(distances, 1 - vectors @ centroids[i])
+    return centroids
+
+
+def kmeans(vectors, k, iterations=25, seed=0):
+    """
+    Spherical k-means: rows and centroids are unit vectors and items go to
+    the centroid with the highest cosine similarity.
+
+    Returns:
+        tuple: (labels array, centroid matrix, similarity of each row to its
+        centroid)
+    """
+    rng = np.random.default_rng(seed)
+    k = max(1, min(k, len(vectors)))
+    centroids = _init_centroids(vectors, k, rng)
+    labels = None
+
+    for _ in range(iterations):
+        new_labels, similarities = _assign(vectors, centroids)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+
+        # One-hot matmul is far faster than np.add.at for summing members
+        membership = np.zeros((k, len(vectors)), dtype=np.float32)
+        membership[labels, np.arange(len(vectors))] = 1
+        sums = membership @ vectors
+        counts = np.bincount(labels, minlength=k)
+        for empty in np.flatnonzero(counts == 0):
+            # Re-seed an empty cluster with the worst-fitting item
+            worst = similarities.argmin()
+            sums[empty] = vectors[worst]
+            similarities[worst] = np.inf
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        np.divide(sums, norms, out=centroids, where=norms > 0)
+
+    labels, similarities = _assign(vectors, centroids)
+    return labels, centroids, similarities
+
+
+def default_cluster_count(n_items, max_clusters=None):
+    """Rule of thumb sqrt(n / 2), capped so a board stays readable"""
+    max_clusters = max_clusters or int(os.getenv("CLUSTER_MAX_GROUPS", "40"))
+    return max(1, min(max_clusters, round(math.sqrt(n_items / 2))))
+
+
+def cluster_items(items, k=None, representatives=5, seed=0):
+    """
+    Group free-text items by similarity without calling the LLM.
+
+    Repeated items (ignoring case and whitespace) are clustered once.
+    Items are clustered on TF-IDF vectors of this batch, but the returned
+    centroids are computed from idf=False vectors, like the ones
+    assign_items compares against them, so stored centroids stay
+    comparable with items of later batches.
+
+    Args:
+        items (list): Item strings
+        k (int): Number of clusters (default: default_cluster_count)
+        representatives (int): Items closest to each centroid to keep for naming
+
+    Returns:
+        list: One dict per non-empty cluster, largest first, with "items"
+        (unique items), "representatives", "size" (including repeats) and
+        "centroid" (unit vector without IDF weighting)
+    """
+    occurrences = Counter()
+    unique = {}
+    for item in items:
+        item = str(item).strip()
+        if not item:
+            continue
+        key = normalize_item(item)
+        occurrences[key] += 1
+        unique.setdefault(key, item)
+    if not unique:
+        return []
+
+    keys = list(unique)
+    texts = [unique[key] for key in keys]
+    vectors = vectorize(texts)
+    labels, centroids, similarities = kmeans(
+        vectors, k or default_cluster_count(len(texts)), seed=seed
+    )
+    plain_vectors = vectorize(texts, idf=False)
+
+    clusters = []
+    for label in range(len(centroids)):
+        members = np.flatnonzero(labels == label)
+        if not len(members):
+            continue
+        members = members[np.argsort(-similarities[members])]
+        clusters.append(
+            {
+                "items": [texts[i] for i in members],
+                "representatives": [texts[i] for i in members[:representatives]],
+                "size": int(sum(occurrences[keys[i]] for i in members)),
+                "centroid": merge_centroid(
+                    np.zeros(plain_vectors.shape[1], np.float32),
+                    0,
+                    plain_vectors[members],
+                ),
+            }
+        )
+    clusters.sort(key=lambda cluster: cluster["size"], reverse=True)
+    return clusters
+
+
+def assign_items(items, centroids, threshold):
+    """
+    Match items against existing group centroids in O(items * groups).
+
+    Items are vectorized with idf=False, as the centroids from cluster_items
+    and merge_centroid are, so a similarity depends on the item and the
+    group only, not on the other items of the batch.
+
+    Args:
+        items (list): Item strings
+        centroids (np.ndarray): Unit-vector centroids, one row per group
+        threshold (float): Minimum cosine similarity to join a group
+
+    Returns:
+        tuple: (index of the matched centroid or -1 for each item, the item
+        vectors)
+    """
+    vectors = vectorize(items, idf=False)
+    labels = np.full(len(items), -1, dtype=np.int64)
+    if len(items) and len(centroids):
+        nearest, similarities = _assign(vectors, np.asarray(centroids, np.float32))
+        matched = similarities >= threshold
+        labels[matched] = nearest[matched]
+    return labels, vectors
+
+
+def merge_centroid(centroid, count, vectors):
+    """Centroid of a group of count items after adding vectors to it"""
+    merged = np.asarray(centroid, np.float32) * count + vectors.sum(axis=0)
+    norm = np.linalg.norm(merged)
+    return merged / norm if norm > 0 else merged
@@ -1,7 +1,129 @@
+import csv
+import io
+import math
+
 import pandas as pd
-import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import execute_values
+from db_connections import get_connection, release_connection
+from instrumentation import get_logger, get_metrics
+from list_fields import LIST_ITEMS_DDL, sync_list_items_sql, top_items_sql
+
+logger = get_logger(__name__)
+metrics = get_metrics()
+
+# Column types of analyzed_comments_staging, in table order
+STAGING_COLUMNS = [
+    ("id", "VARCHAR"),
+    ("content", "TEXT"),
+    ("author", "VARCHAR"),
+    ("created_utc", "TIMESTAMP"),
+    ("score", "INTEGER"),
+    ("permalink", "TEXT"),
+    ("subreddit", "VARCHAR"),
+    ("parent_id", "VARCHAR"),
+    ("is_submitter", "BOOLEAN"),
+    ("post_title", "TEXT"),
+    ("post_hash", "VARCHAR"),
+    ("comment_hash", "VARCHAR PRIMARY KEY"),
+    ("scanned", "VARCHAR(1)"),
+    ("pain_points", "TEXT"),
+    ("gain_points", "TEXT"),
+    ("jobs_to_be_done", "TEXT"),
+    ("themes", "TEXT"),
+    ("relevance_score", "FLOAT"),
+    ("ideal_features", "TEXT"),
+]
+
+# Spellings of a missing value that may appear in CSVs written by pandas
+NULL_STRINGS = ["", "nan", "NaN", "None", "NULL", "null"]
+
+
+def _cast_expression(column, column_type, table=None):
+    """
+    SQL turning a raw text column of the load table into column_type, with
+    NaN-like spellings mapped to NULL. Pass table to qualify the column.
+    """
+    column_type = column_type.split()[0]
+    col = sql.Identifier(table, column) if table else sql.Identifier(column)
+    if column_type == "TEXT" or column_type.startswith("VARCHAR"):
+        return col
+
+    value = sql.SQL("NULLIF(btrim({}), '')").format(col)
+    is_null = sql.SQL("lower(btrim({})) = ANY({})").format(
+        col, sql.Literal([s.lower() for s in NULL_STRINGS])
+    )
+    if column_type == "INTEGER":
+        # Columns holding NaN are written by pandas as floats, e.g. "85.0"
+        cast = sql.SQL("round({}::numeric)::integer").format(value)
+    elif column_type == "FLOAT":
+        cast = sql.SQL("{}::double precision").format(value)
+    elif column_type == "BOOLEAN":
+        cast = sql.SQL(
+            "CASE WHEN lower(btrim({col})) IN ('1', '1.0') THEN true "
+            "WHEN lower(btrim({col})) IN ('0', '0.0') THEN false "
+            "ELSE {value}::boolean END"
+        ).format(col=col, value=value)
+    elif column_type == "TIMESTAMP":
+        # Epoch seconds as returned by PRAW, or an ISO timestamp
+        cast = sql.SQL(
+            "CASE WHEN btrim({col}) ~ '^[0-9]+(\\.[0-9]*)?$' "
+            "THEN to_timestamp({value}::double precision) AT TIME ZONE 'UTC' "
+            "ELSE {value}::timestamp END"
+        ).format(col=col, value=value)
+    else:
+        cast = sql.SQL("{}::{}").format(value, sql.SQL(column_type))
+    return sql.SQL("CASE WHEN {} THEN NULL ELSE {} END").format(is_null, cast)
+
+
+def _copy_text(value):
+    """Text form of a Python value for COPY CSV; None means NULL"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return str(value)
+
+
+class _CopyStream(io.TextIOBase):
+    """
+    File-like object feeding COPY FROM STDIN from an iterator of rows, encoded
+    as CSV a block at a time so the source is never materialized in memory.
+    """
+
+    def __init__(self, rows, rows_per_block=1000):
+        self.rows = iter(rows)
+        self.rows_per_block = rows_per_block
+        self.block = io.StringIO()
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        """Encode the next block of rows; returns False once rows run out"""
+        block = io.StringIO()
+        writer = csv.writer(block)
+        count = 0
+        for row in self.rows:
+            # None becomes an unquoted empty field, which COPY CSV reads as NULL
+            writer.writerow([_copy_text(value) for value in row])
+            count += 1
+            if count >= self.rows_per_block:
+                break
+        block.seek(0)
+        self.block = block
+        return count > 0
+
+    def read(self, size=-1):
+        data = self.block.read(size)
+        while size < 0 or len(data) < size:
+            if not self._fill():
+                break
+            data += self.block.read(size - len(data) if size > 0 else -1)
+        return data
+
+
+def _chain_first(first, rows):
+    yield first
+    yield from rows
 
 
 class DBInserter:
@@ -16,7 +138,11 @@ class DBInserter:
         }
 
     def _get_connection(self):
-        return psycopg2.connect(**self.conn_params)
+        """Check a connection out of the shared pool for these parameters"""
+        return get_connection(self.conn_params)
+
+    def _release_connection(self, conn):
+        release_connection(self.conn_params, conn)
 
     def update_column_from_csv(self, csv_path, column_name):
         """
@@ -26,36 +152,116 @@ class DBInserter:
             csv_path (str): Path to the CSV file
             column_name (str): Name of the column to update
         """
-        # Read CSV file
-        df = pd.read_csv(csv_path)
+        return self.update_columns_from_csv(csv_path, [column_name])
 
-        conn = self._get_connection()
-        cur = conn.cursor()
+    @metrics.timed("db_write", operation="update_columns")
+    def update_columns_from_csv(self, csv_path, column_names):
+        """
+        Updates several columns from a CSV file to the staging table in bulk
 
-        try:
-            # Update staging table
-            for idx, row in df.iterrows():
-                update_query = sql.SQL(
-                    """
-                    UPDATE analyzed_comments_staging 
-                    SET {} = %s
-                    WHERE comment_hash = %s
+        The (comment_hash, values...) pairs are streamed into a temporary table
+        with COPY and applied with a single UPDATE ... FROM join, instead of
+        one UPDATE round-trip per row. If a hash appears more than once in the
+        CSV, its last row wins.
+
+        Args:
+            csv_path (str): Path to the CSV file
+            column_names (list): Names of the columns to update
+
+        Returns:
+            dict: Rows read from the CSV, staging rows matched and updated,
+            and CSV hashes missing from the staging table
+        """
+        column_types = dict(STAGING_COLUMNS)
+        load_columns = ["comment_hash"] + list(column_names)
+
+        with open(csv_path, newline="", encoding="utf-8") as csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader)
+            positions = [header.index(col) for col in load_columns]
+
+            conn = self._get_connection()
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    sql.SQL(
+                        "CREATE TEMP TABLE column_updates "
+                        "(row_number SERIAL, {}) ON COMMIT DROP"
+                    ).format(
+                        sql.SQL(",").join(
+                            sql.SQL("{} TEXT").format(sql.Identifier(col))
+                            for col in load_columns
+                        )
+                    )
+                )
+                cur.copy_expert(
+                    sql.SQL("COPY column_updates ({}) FROM STDIN WITH (FORMAT csv)")
+                    .format(sql.SQL(",").join(map(sql.Identifier, load_columns)))
+                    .as_string(conn),
+                    _CopyStream([row[i] for i in positions] for row in reader),
+                    size=1 << 20,
+                )
+                rows = cur.rowcount
+
+                cur.execute(
+                    sql.SQL(
+                        """
+                    UPDATE analyzed_comments_staging AS s
+                    SET {assignments}
+                    FROM (
+                        SELECT DISTINCT ON (comment_hash) *
+                        FROM column_updates
+                        ORDER BY comment_hash, row_number DESC
+                    ) AS u
+                    WHERE s.comment_hash = u.comment_hash
                 """
-                ).format(sql.Identifier(column_name))
+                    ).format(
+                        assignments=sql.SQL(",").join(
+                            sql.SQL("{} = {}").format(
+                                sql.Identifier(col),
+                                _cast_expression(
+                                    col, column_types.get(col, "TEXT"), table="u"
+                                ),
+                            )
+                            for col in column_names
+                        )
+                    )
+                )
+                matched = cur.rowcount
 
-                cur.execute(update_query, (row[column_name], row["comment_hash"]))
+                cur.execute(
+                    """
+                    SELECT COUNT(DISTINCT u.comment_hash)
+                    FROM column_updates AS u
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM analyzed_comments_staging AS s
+                        WHERE s.comment_hash = u.comment_hash
+                    )
+                """
+                )
+                missing = cur.fetchone()[0]
 
-            conn.commit()
-            print(f"Successfully updated {column_name} column in staging table")
+                conn.commit()
+                metrics.incr(
+                    "db_rows_written_total", matched, table="analyzed_comments_staging"
+                )
+                logger.info(
+                    f"Successfully updated {', '.join(column_names)} in staging "
+                    f"table: {rows} CSV rows, {matched} matched, {missing} missing"
+                )
+                return {"rows": rows, "matched": matched, "missing": missing}
 
-        except Exception as e:
-            conn.rollback()
-            print(f"Error updating column {column_name}: {str(e)}")
-            raise
-        finally:
-            cur.close()
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                logger.error(
+                    f"Error updating columns {', '.join(column_names)}: {str(e)}"
+                )
+                raise
+            finally:
+                cur.close()
+                self._release_connection(conn)
 
+    @metrics.timed("db_write", operation="merge")
     def merge_staging_to_main(self):
         """Merges records from analyzed_comments_staging into analyzed_comments"""
         conn = self._get_connection()
@@ -125,79 +331,263 @@ class DBInserter:
             """
             cur.execute(merge_sql)
 
+            # Rebuild the list item rows of the merged comments
+            self._create_list_items_table(cur)
+            for statement in sync_list_items_sql(
+                "c.comment_hash IN "
+                "(SELECT comment_hash FROM analyzed_comments_staging)"
+            ):
+                cur.execute(statement)
+
             # Truncate staging table
             cur.execute("TRUNCATE TABLE analyzed_comments_staging")
 
             conn.commit()
-            print("Successfully merged staging data into main table")
+            logger.info("Successfully merged staging data into main table")
 
         except Exception as e:
             conn.rollback()
-            print(f"Error merging tables: {str(e)}")
+            logger.error(f"Error merging tables: {str(e)}")
             raise
         finally:
             cur.close()
-            conn.close()
+            self._release_connection(conn)
 
-    def insert_analyzed_comments_staging(self, csv_path):
-        # Read the CSV file
-        df = pd.read_csv(csv_path)
+    def _create_list_items_table(self, cur):
+        for statement in LIST_ITEMS_DDL:
+            cur.execute(statement)
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_analyzed_comments_created_utc
+            ON analyzed_comments (created_utc)
+        """
+        )
+
+    @metrics.timed("db_write", operation="sync_list_items")
+    def sync_list_items(self, only_missing=True):
+        """
+        Unpack the list fields of analyzed_comments into comment_list_items.
+
+        merge_staging_to_main keeps the table current; this backfills rows
+        merged before it existed, including legacy comma-joined values.
+
+        Args:
+            only_missing (bool): Only sync comments without any list item rows
+
+        Returns:
+            int: Number of list item rows written
+        """
+        where = "TRUE"
+        if only_missing:
+            where = (
+                "NOT EXISTS (SELECT 1 FROM comment_list_items i "
+                "WHERE i.comment_hash = c.comment_hash)"
+            )
+
+        conn = self._get_connection()
+        cur = conn.cursor()
+        try:
+            self._create_list_items_table(cur)
+            for statement in sync_list_items_sql(where):
+                cur.execute(statement)
+            inserted = cur.rowcount
+            conn.commit()
+            metrics.incr("db_rows_written_total", inserted, table="comment_list_items")
+            logger.info(f"Synced {inserted} list items")
+            return inserted
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error syncing list items: {str(e)}")
+            raise
+        finally:
+            cur.close()
+            self._release_connection(conn)
+
+    def top_items(self, field, per="subreddit", since=None, limit=10):
+        """
+        Most mentioned items of a list field per value of another column,
+        e.g. top_items("themes", since=one_week_ago) for the top themes of the
+        week per subreddit. The aggregation runs entirely in SQL.
+
+        Returns:
+            DataFrame: (per, item, mentions) rows, up to limit per group
+        """
+        if per not in dict(STAGING_COLUMNS):
+            raise ValueError(f"Unknown column: {per}")
 
-        # Create database connection
         conn = self._get_connection()
         cur = conn.cursor()
+        try:
+            cur.execute(
+                top_items_sql(field, per, "%(limit)s", "%(since)s"),
+                {"limit": limit, "since": since or "-infinity"},
+            )
+            return pd.DataFrame(cur.fetchall(), columns=[per, "item", "mentions"])
+        finally:
+            cur.close()
+            self._release_connection(conn)
 
-        # Create staging table if it doesn't exist
-        create_table_sql = """
+    def _create_staging_table(self, cur):
+        create_table_sql = f"""
         CREATE TABLE IF NOT EXISTS analyzed_comments_staging (
-            id VARCHAR,
-            content TEXT,
-            author VARCHAR, 
-            created_utc TIMESTAMP,
-            score INTEGER,
-            permalink TEXT,
-            subreddit VARCHAR,
-            parent_id VARCHAR,
-            is_submitter BOOLEAN,
-            post_title TEXT,
-            post_hash VARCHAR,
-            comment_hash VARCHAR PRIMARY KEY,
-            scanned VARCHAR(1),
-            pain_points TEXT,
-            gain_points TEXT,
-            jobs_to_be_done TEXT,
-            themes TEXT,
-            relevance_score FLOAT,
-            ideal_features TEXT
+            {', '.join(f"{col} {dtype}" for col, dtype in STAGING_COLUMNS)}
         )
         """
         cur.execute(create_table_sql)
 
-        # Insert data in chunks
-        chunk_size = 500
-        for i in range(0, len(df), chunk_size):
-            chunk = df.iloc[i : i + chunk_size]
+    @metrics.timed("db_write", operation="copy_staging")
+    def copy_analyzed_comments_staging(self, source, columns=None):
+        """
+        Bulk load comments into the staging table with COPY FROM STDIN.
+
+        A CSV file is streamed to the server as is; other sources are encoded
+        to CSV block by block. Either way nothing is loaded into a DataFrame.
+        Rows land in a temporary all-text table and are then cast to the
+        staging column types in SQL (created_utc from ISO text or epoch
+        seconds, score, is_submitter, relevance_score; empty and NaN-like
+        values become NULL) and inserted with ON CONFLICT (comment_hash)
+        DO NOTHING, like the execute_values path.
 
-            columns = list(df.columns)
-            values = [tuple(x) for x in chunk.values]
+        Args:
+            source: Path to a CSV file with a header row, or an iterable of
+                dicts or sequences
+            columns (list): Column names for sequence rows; taken from the
+                first dict otherwise
 
-            insert_query = sql.SQL(
-                """
-                INSERT INTO analyzed_comments_staging ({})
-                VALUES %s
+        Returns:
+            int: Number of rows newly inserted
+        """
+        column_types = dict(STAGING_COLUMNS)
+        csv_file = None
+        if isinstance(source, str):
+            csv_file = open(source, newline="", encoding="utf-8")
+            columns = next(csv.reader(csv_file))
+            # Rewind so COPY reads the header line itself and skips it
+            csv_file.seek(0)
+            stream = csv_file
+            copy_options = "FORMAT csv, HEADER true"
+        else:
+            rows = iter(source)
+            if columns is None:
+                first = next(rows, None)
+                if first is None:
+                    return 0
+                columns = list(first)
+                rows = _chain_first(first, rows)
+            stream = _CopyStream(
+                [row.get(col) for col in columns] if isinstance(row, dict) else row
+                for row in rows
+            )
+            copy_options = "FORMAT csv"
+
+        # Columns the staging table doesn't know about are loaded but dropped
+        load_columns = [col for col in columns if col in column_types]
+        dropped = [col for col in columns if col not in column_types]
+        if dropped:
+            logger.warning(
+                f"Ignoring columns not in staging table: {', '.join(dropped)}"
+            )
+
+        conn = self._get_connection()
+        cur = conn.cursor()
+        try:
+            self._create_staging_table(cur)
+            cur.execute(
+                sql.SQL(
+                    "CREATE TEMP TABLE analyzed_comments_load ({}) ON COMMIT DROP"
+                ).format(
+                    sql.SQL(",").join(
+                        sql.SQL("{} TEXT").format(sql.Identifier(col))
+                        for col in columns
+                    )
+                )
+            )
+            cur.copy_expert(
+                sql.SQL("COPY analyzed_comments_load ({}) FROM STDIN WITH ({})")
+                .format(
+                    sql.SQL(",").join(map(sql.Identifier, columns)),
+                    sql.SQL(copy_options),
+                )
+                .as_string(conn),
+                stream,
+                size=1 << 20,
+            )
+            copied = cur.rowcount
+
+            cur.execute(
+                sql.SQL(
+                    """
+                INSERT INTO analyzed_comments_staging ({cols})
+                SELECT {casts} FROM analyzed_comments_load
                 ON CONFLICT (comment_hash) DO NOTHING
             """
-            ).format(sql.SQL(",").join(map(sql.Identifier, columns)))
+                ).format(
+                    cols=sql.SQL(",").join(map(sql.Identifier, load_columns)),
+                    casts=sql.SQL(",").join(
+                        _cast_expression(col, column_types[col]) for col in load_columns
+                    ),
+                )
+            )
+            inserted = cur.rowcount
+            conn.commit()
+            metrics.incr(
+                "db_rows_written_total", inserted, table="analyzed_comments_staging"
+            )
+            logger.info(
+                f"Copied {copied} rows, inserted {inserted} new rows into staging table"
+            )
+            return inserted
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error copying into staging table: {str(e)}")
+            raise
+        finally:
+            cur.close()
+            self._release_connection(conn)
+            if csv_file is not None:
+                csv_file.close()
 
-            # Execute the insert
-            execute_values(cur, insert_query, values)
+    @metrics.timed("db_write", operation="insert_staging")
+    def insert_analyzed_comments_staging(self, csv_path):
+        # Read the CSV file
+        df = pd.read_csv(csv_path)
 
-        # Commit and close
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Create database connection
+        conn = self._get_connection()
+        cur = conn.cursor()
+        try:
+            # Create staging table if it doesn't exist
+            self._create_staging_table(cur)
+
+            # Insert data in chunks
+            chunk_size = 500
+            for i in range(0, len(df), chunk_size):
+                chunk = df.iloc[i : i + chunk_size]
+
+                columns = list(df.columns)
+                values = [tuple(x) for x in chunk.values]
+
+                insert_query = sql.SQL(
+                    """
+                    INSERT INTO analyzed_comments_staging ({})
+                    VALUES %s
+                    ON CONFLICT (comment_hash) DO NOTHING
+                """
+                ).format(sql.SQL(",").join(map(sql.Identifier, columns)))
+
+                # Execute the insert
+                execute_values(cur, insert_query, values)
+
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error inserting into staging table: {str(e)}")
+            raise
+        finally:
+            cur.close()
+            self._release_connection(conn)
 
 
 if __name__ == "__main__":
     db_inserter = DBInserter()
-    db_inserter.insert_analyzed_comments_staging("analyzed_journaling_comments.csv")
+    db_inserter.copy_analyzed_comments_staging("analyzed_journaling_comments.csv")
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class HashStore:
+    """
+    Persistent index of every comment_hash already saved.
+
+    Membership checks and appends only touch the new hashes through the
+    primary key index, so each scrape costs O(new comments) no matter how
+    much history has accumulated.
+    """
+
+    # Stay well below SQLite's limit on bound parameters per statement
+    LOOKUP_CHUNK_SIZE = 500
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("HASH_STORE_PATH", "comment_hashes.sqlite3")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS comment_hashes (
+                comment_hash TEXT PRIMARY KEY,
+                subreddit TEXT,
+                added_at REAL
+            ) WITHOUT ROWID
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS seeded_sources (
+                source TEXT PRIMARY KEY,
+                seeded_at REAL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            row = self.conn.execute("SELECT COUNT(*) FROM comment_hashes").fetchone()
+        return row[0]
+
+    def existing(self, hashes):
+        """Return the subset of hashes that are already stored"""
+        hashes = list(hashes)
+        found = set()
+        with self.lock:
+            for i in range(0, len(hashes), self.LOOKUP_CHUNK_SIZE):
+                chunk = hashes[i : i + self.LOOKUP_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT comment_hash FROM comment_hashes "
+                    f"WHERE comment_hash IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def filter_new(self, comments):
+        """Drop comments whose comment_hash is stored or repeated in the batch"""
+        existing = self.existing({comment["comment_hash"] for comment in comments})
+        unique_comments = []
+        for comment in comments:
+            if comment["comment_hash"] in existing:
+                continue
+            existing.add(comment["comment_hash"])
+            unique_comments.append(comment)
+        return unique_comments
+
+    def add(self, comments):
+        """Record the comment_hash of each saved comment"""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO comment_hashes VALUES (?, ?, ?)",
+                (
+                    (comment["comment_hash"], comment.get("subreddit"), now)
+                    for comment in comments
+                ),
+            )
+            self.conn.commit()
+
+    def seed_from_csv(self, csv_path, chunksize=50000):
+        """
+        One-off import of the hashes in an existing comments CSV. Only the
+        comment_hash column is read, in chunks. Returns the rows imported.
+        """
+        source = os.path.abspath(csv_path)
+        with self.lock:
+            seeded = self.conn.execute(
+                "SELECT 1 FROM seeded_sources WHERE source = ?", (source,)
+            ).fetchone()
+        if seeded or not os.path.exists(csv_path):
+            return 0
+
+        imported = 0
+        for chunk in pd.read_csv(
+            csv_path, usecols=["comment_hash"], chunksize=chunksize
+        ):
+            hashes = chunk["comment_hash"].dropna()
+            self.add({"comment_hash": h} for h in hashes)
+            imported += len(hashes)
+
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO seeded_sources VALUES (?, ?)",
+                (source, time.time()),
+            )
+            self.conn.commit()
+        return imported
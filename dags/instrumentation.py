@@ -0,0 +1,276 @@
+import functools
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Parent of every pipeline logger, so LOG_LEVEL applies to all of them at once
+LOGGER_NAME = "reddit_pipeline"
+
+# Upper bounds in seconds of the span duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def get_logger(name):
+    """
+    Logger for a pipeline module, a child of LOGGER_NAME whose level comes
+    from LOG_LEVEL (default INFO). Outside Airflow, where nothing configures
+    logging, messages go to stderr.
+    """
+    parent = logging.getLogger(LOGGER_NAME)
+    if parent.level == logging.NOTSET:
+        parent.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    if not logging.getLogger().handlers:
+        logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    return parent.getChild(name)
+
+
+_sample_lock = threading.Lock()
+_sample_counts = {}
+
+
+def log_sampled(logger, level, key, message, *args, every=None):
+    """
+    Log the first message for key and then only every every-th one (default
+    LOG_SAMPLE_EVERY, 100), for messages emitted once per row. The message
+    is formatted only when it is actually logged.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    every = every or int(os.getenv("LOG_SAMPLE_EVERY", "100"))
+    with _sample_lock:
+        count = _sample_counts.get(key, 0)
+        _sample_counts[key] = count + 1
+    if count % every == 0:
+        logger.log(level, message, *args)
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _prometheus_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class StatsdClient:
+    """Fire-and-forget StatsD over UDP; metrics are dropped if nobody listens"""
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self.address = (
+            host or os.getenv("STATSD_HOST", "localhost"),
+            int(port or os.getenv("STATSD_PORT", "8125")),
+        )
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _name(self, name, labels):
+        # Plain StatsD has no labels, so their values become path segments
+        parts = [self.prefix, name] + [f"{key}_{value}" for key, value in labels]
+        return ".".join(part.replace(".", "_").replace(":", "_") for part in parts)
+
+    def send(self, name, labels, value, kind):
+        try:
+            self.socket.sendto(
+                f"{self._name(name, labels)}:{value}|{kind}".encode("utf-8"),
+                self.address,
+            )
+        except OSError:
+            pass
+
+
+class Metrics:
+    """
+    Process-wide counters, gauges and span duration histograms.
+
+    Counters, gauges and histograms are keyed by name and labels. export() writes
+    them in the Prometheus text format (METRICS_EXPORT=prometheus, the
+    default) to METRICS_DIR/<job>.prom, e.g. for node_exporter's textfile
+    collector. With METRICS_EXPORT=statsd every update is also sent to
+    STATSD_HOST:STATSD_PORT as it happens. METRICS_EXPORT=off keeps the
+    metrics in memory only.
+    """
+
+    def __init__(self, prefix=None, exporter=None):
+        self.prefix = prefix or os.getenv("METRICS_PREFIX", LOGGER_NAME)
+        self.exporter = exporter or os.getenv("METRICS_EXPORT", "prometheus")
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        # (name, labels) -> [count per bucket..., count, sum]
+        self.histograms = {}
+        self.statsd = None
+        if self.exporter == "statsd":
+            self.statsd = StatsdClient(prefix=self.prefix)
+
+    def incr(self, name, value=1, **labels):
+        """Add value to the counter name{labels}"""
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        if self.statsd is not None:
+            self.statsd.send(name, key[1], value, "c")
+
+    def gauge(self, name, value, **labels):
+        """Set the gauge name{labels} to value"""
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.gauges[key] = value
+        if self.statsd is not None:
+            self.statsd.send(name, key[1], value, "g")
+
+    def observe(self, name, seconds, **labels):
+        """Record a duration in the histogram name{labels}"""
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = [0] * (len(DURATION_BUCKETS) + 2)
+                self.histograms[key] = histogram
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += 1
+            histogram[-1] += seconds
+        if self.statsd is not None:
+            self.statsd.send(name, key[1], round(seconds * 1000, 3), "ms")
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the block into the histogram name{labels, status=ok|error}"""
+        started_at = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.observe(
+                name, time.perf_counter() - started_at, status=status, **labels
+            )
+
+    def timed(self, name, **labels):
+        """Decorator running every call of the function in span(name, **labels)"""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def value(self, name, **labels):
+        """Current value of a counter or gauge, summed over labels not given"""
+        wanted = set(_label_key(labels))
+        with self.lock:
+            return sum(
+                value
+                for values in (self.counters, self.gauges)
+                for (metric, key), value in values.items()
+                if metric == name and wanted <= set(key)
+            )
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def prometheus_text(self, extra_labels=None):
+        """All metrics in the Prometheus text exposition format"""
+        extra = _label_key(extra_labels or {})
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(
+                (key, list(histogram)) for key, histogram in self.histograms.items()
+            )
+
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_prometheus_labels(labels + extra)} {value}")
+
+        for (name, labels), value in gauges:
+            metric = f"{self.prefix}_{name}"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric}{_prometheus_labels(labels + extra)} {value}")
+
+        for (name, labels), histogram in histograms:
+            metric = f"{self.prefix}_{name}_seconds"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, histogram):
+                cumulative += count
+                bucket_labels = labels + extra + (("le", str(bound)),)
+                lines.append(
+                    f"{metric}_bucket{_prometheus_labels(bucket_labels)} {cumulative}"
+                )
+            bucket_labels = labels + extra + (("le", "+Inf"),)
+            lines.append(
+                f"{metric}_bucket{_prometheus_labels(bucket_labels)} {histogram[-2]}"
+            )
+            lines.append(
+                f"{metric}_sum{_prometheus_labels(labels + extra)} {histogram[-1]}"
+            )
+            lines.append(
+                f"{metric}_count{_prometheus_labels(labels + extra)} {histogram[-2]}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def export(self, job):
+        """
+        Publish the metrics of a finished task. With the Prometheus exporter
+        they are written to METRICS_DIR/<job>.prom (labelled job=<job>),
+        replacing the file atomically.
+
+        Returns:
+            str: Path of the written file, or None
+        """
+        if self.exporter != "prometheus":
+            return None
+        directory = os.getenv("METRICS_DIR", "metrics")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{job}.prom")
+        with open(path + ".tmp", "w") as f:
+            f.write(self.prometheus_text({"job": job}))
+        os.replace(path + ".tmp", path)
+        return path
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Return the process-wide Metrics, configured from the environment"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
@@ -0,0 +1,134 @@
+import json
+import math
+
+import pandas as pd
+
+# Analysis fields holding a list of short strings
+LIST_FIELDS = ["pain_points", "gain_points", "jobs_to_be_done", "themes"]
+
+# One row per list entry of every analyzed comment, so aggregations and
+# lookups by item run in SQL against an index instead of re-splitting text
+LIST_ITEMS_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS comment_list_items (
+        comment_hash VARCHAR NOT NULL,
+        field VARCHAR NOT NULL,
+        position INTEGER NOT NULL,
+        item TEXT NOT NULL,
+        PRIMARY KEY (comment_hash, field, position)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_comment_list_items_field_item
+    ON comment_list_items (field, item)
+    """,
+]
+
+
+def encode_list(items):
+    """Serialize a list field as a JSON array, so items may contain commas"""
+    return json.dumps([str(item) for item in items], ensure_ascii=False)
+
+
+def decode_list(value):
+    """
+    Items of a stored list field: a JSON array, or legacy comma-joined text
+    from before list fields were stored as JSON.
+    """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    value = str(value).strip()
+    if value.startswith("["):
+        try:
+            return [str(item) for item in json.loads(value)]
+        except json.JSONDecodeError:
+            pass
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def explode_list_fields(df, fields=None):
+    """
+    DataFrame counterpart of comment_list_items: one row per list entry of
+    df, with (comment_hash, field, position, item) columns. Uses pandas'
+    explode instead of looping over rows.
+    """
+    frames = []
+    for field in fields or LIST_FIELDS:
+        if field not in df.columns:
+            continue
+        exploded = pd.DataFrame(
+            {
+                "comment_hash": df["comment_hash"].to_numpy(),
+                "item": df[field].map(decode_list).to_numpy(),
+            }
+        ).explode("item")
+        exploded = exploded[exploded["item"].notna()]
+        exploded["field"] = field
+        exploded["position"] = exploded.groupby(level=0).cumcount() + 1
+        frames.append(exploded)
+
+    columns = ["comment_hash", "field", "position", "item"]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)[columns]
+
+
+def sync_list_items_sql(where):
+    """
+    SQL rebuilding comment_list_items for the analyzed_comments rows (alias c)
+    matching the where condition. Both JSON arrays and legacy comma-joined
+    text are unpacked in the database.
+    """
+    fields = ", ".join(f"('{field}', c.{field})" for field in LIST_FIELDS)
+    return [
+        f"""
+        DELETE FROM comment_list_items
+        WHERE comment_hash IN (SELECT c.comment_hash FROM analyzed_comments c
+                               WHERE {where})
+        """,
+        f"""
+        INSERT INTO comment_list_items (comment_hash, field, position, item)
+        SELECT c.comment_hash, f.field, e.position, btrim(e.item)
+        FROM analyzed_comments c
+        CROSS JOIN LATERAL (VALUES {fields}) AS f (field, value)
+        CROSS JOIN LATERAL (
+            SELECT j.item, j.position
+            FROM jsonb_array_elements_text(
+                CASE WHEN f.value ~ '^\\s*\\[' THEN f.value::jsonb END
+            ) WITH ORDINALITY AS j (item, position)
+            UNION ALL
+            SELECT s.item, s.position
+            FROM unnest(
+                CASE WHEN f.value !~ '^\\s*\\[' THEN string_to_array(f.value, ',') END
+            ) WITH ORDINALITY AS s (item, position)
+        ) AS e
+        WHERE ({where}) AND btrim(e.item) <> ''
+        ON CONFLICT DO NOTHING
+        """,
+    ]
+
+
+def top_items_sql(field, per, limit_param, since_param):
+    """
+    SQL ranking the most frequent items of a list field per value of the
+    analyzed_comments column per (e.g. subreddit) since a timestamp.
+    """
+    if field not in LIST_FIELDS:
+        raise ValueError(f"Unknown list field: {field}")
+    return f"""
+        SELECT {per}, item, mentions
+        FROM (
+            SELECT c.{per}, i.item, COUNT(*) AS mentions,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY c.{per} ORDER BY COUNT(*) DESC, i.item
+                   ) AS rank
+            FROM comment_list_items i
+            JOIN analyzed_comments c ON c.comment_hash = i.comment_hash
+            WHERE i.field = '{field}' AND c.created_utc >= {since_param}
+            GROUP BY c.{per}, i.item
+        ) ranked
+        WHERE rank <= {limit_param}
+        ORDER BY {per}, mentions DESC, item
+    """
@@ -1,21 +1,29 @@
+import logging
 import os
 from dotenv import load_dotenv
 import pandas as pd
 import json
+import math
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from openai import OpenAI
+from rate_limiter import estimate_tokens, get_scheduler
+from token_budget import PromptBudget
+from llm_cache import LLMResponseCache, fingerprint
+from checkpoint import CheckpointJournal
+from list_fields import LIST_FIELDS, encode_list
+from prefilter import FAILED_RELEVANCE, SKIPPED_RELEVANCE, Prefilter
+from near_duplicates import NearDuplicateIndex, group_near_duplicates, simhashes
+from preprocessing import content_hash, get_preprocessor
+from instrumentation import get_logger, get_metrics, log_sampled
 
 load_dotenv()
 
+logger = get_logger(__name__)
+metrics = get_metrics()
 
-class LLMAnalyzer:
-    def __init__(self):
-        self.client = OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"), base_url="https://api.deepseek.com"
-        )
-
-    def analyze_post(self, content):
-        prompt = f"""
+ANALYSIS_PROMPT = """
         Analyze the following Reddit comment and identify:
         1. Pain points mentioned
         2. Gain points (benefits or positive aspects) 
@@ -35,44 +43,347 @@ class LLMAnalyzer:
         - themes: list of key themes/tags
         - relevance_score: float between 0.1 and 1.0
         """
+ANALYSIS_PROMPT_FINGERPRINT = fingerprint(ANALYSIS_PROMPT)
 
-        max_retries = 3
-        retry_delay = 2  # seconds
+BATCH_ANALYSIS_PROMPT = """
+        Analyze each of the following Reddit comments independently and identify:
+        1. Pain points mentioned
+        2. Gain points (benefits or positive aspects)
+        3. Jobs to be done (what the user is trying to accomplish)
+        4. Key themes/tags for affinity mapping
+        5. Relevance score (0.1-1.0) for building an AI journaling app, where:
+           - 1.0: Highly relevant insights about journaling habits, needs and pain points
+           - 0.5: Moderately useful general journaling discussion
+           - 0.1: Not relevant for AI journaling app development
 
-        for attempt in range(max_retries):
-            try:
-                response = self.client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.7,
-                )
+        Each comment starts with its id in square brackets.
 
-                # Get the response content and clean it up
-                message_content = response.choices[0].message.content
-                print(f"Message content: {message_content}")
+        Comments:
+        {comments}
 
-                # Remove markdown code blocks if present
-                cleaned_content = message_content.strip()
-                if cleaned_content.startswith("```json"):
-                    cleaned_content = cleaned_content[7:]  # Remove ```json
-                if cleaned_content.endswith("```"):
-                    cleaned_content = cleaned_content[:-3]  # Remove ```
-                cleaned_content = cleaned_content.strip()
+        Format your response as JSON with a single key "results" holding one
+        object per comment, in any order, with these keys:
+        - id: the comment id, exactly as given
+        - pain_points: list of pain points
+        - gain_points: list of gain points
+        - jobs_to_be_done: list of jobs
+        - themes: list of key themes/tags
+        - relevance_score: float between 0.1 and 1.0
+        """
+BATCH_ANALYSIS_PROMPT_FINGERPRINT = fingerprint(BATCH_ANALYSIS_PROMPT)
 
-                analysis = json.loads(cleaned_content)
-                print(
-                    f"Successfully analyzed post. Analysis: {json.dumps(analysis, indent=2)}"
-                )
+ANALYSIS_LIST_KEYS = LIST_FIELDS
+
+
+def is_valid_analysis(analysis):
+    """
+    Check that an analysis has every list field as a list and a numeric
+    relevance_score. Replies failing this are retried, and cached or
+    journaled entries failing it are ignored.
+    """
+    if not isinstance(analysis, dict):
+        return False
+    if not all(isinstance(analysis.get(key), list) for key in ANALYSIS_LIST_KEYS):
+        return False
+    try:
+        return math.isfinite(float(analysis.get("relevance_score")))
+    except (TypeError, ValueError):
+        return False
+
+
+# Length of the comment_hash prefix used as the per-item id in batched prompts
+BATCH_ID_LENGTH = 12
+
+
+class AnalysisResults:
+    """
+    Columnar buffer of analysis results. Rows are collected into one list
+    per column and written to the frame in a single vectorized assignment,
+    instead of five df.at writes per analyzed row.
+    """
+
+    def __init__(self):
+        self.index = []
+        self.columns = {column: [] for column in LIST_FIELDS + ["relevance_score"]}
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, idx, analysis):
+        """Buffer the analysis (or None for a failure) of row idx"""
+        self.index.append(idx)
+        for field in LIST_FIELDS:
+            self.columns[field].append(analysis[field] if analysis else [])
+        self.columns["relevance_score"].append(
+            analysis["relevance_score"] if analysis else FAILED_RELEVANCE
+        )
+
+    def apply(self, df):
+        """Write the buffered rows into df, mark them scanned and clear the buffer"""
+        if not self.index:
+            return
+        values = pd.DataFrame(
+            {
+                # Stored as JSON arrays so items may contain commas
+                **{
+                    field: map(encode_list, self.columns[field])
+                    for field in LIST_FIELDS
+                },
+                "relevance_score": pd.to_numeric(
+                    self.columns["relevance_score"], errors="coerce"
+                ),
+                "scanned": "Y",
+            },
+            index=self.index,
+        )
+        df.loc[values.index, values.columns] = values
+        self.__init__()
+
+
+class LLMAnalyzer:
+    def __init__(self, max_workers=None):
+        # LLM_BASE_URL lets the analyzer run against any OpenAI-compatible
+        # server, e.g. a local fake when testing. Retries are owned by the
+        # shared scheduler, not the OpenAI client.
+        self.client = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("LLM_BASE_URL", "https://api.deepseek.com"),
+            max_retries=0,
+        )
+        self.scheduler = get_scheduler()
+        self.cache = LLMResponseCache()
+        self.model = "deepseek-chat"
+        self.temperature = 0.7
+        # Maximum number of LLM requests in flight during analyze_dataframe
+        self.max_workers = max_workers or int(os.getenv("LLM_MAX_WORKERS", "8"))
+        # Prompt token budget per batched request; 0 analyzes one comment per call
+        self.batch_token_budget = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "0"))
+        self.batch_max_items = int(os.getenv("LLM_BATCH_MAX_ITEMS", "20"))
+        # Rewrite the CSV every N analyzed rows; 0 writes it once at the end
+        self.checkpoint_interval = int(os.getenv("ANALYSIS_CHECKPOINT_INTERVAL", "0"))
+        self.prefilter = Prefilter()
+        # Hashing, markdown cleanup and token counts run on a process pool
+        self.preprocessor = get_preprocessor()
+        # Caps on comment and prompt tokens, see token_budget.py
+        self.budget = PromptBudget()
+        # Comments within a few SimHash bits of an analyzed one reuse its
+        # analysis; NEAR_DUP_MODE=off sends every comment to the LLM
+        self.near_duplicates = None
+        if os.getenv("NEAR_DUP_MODE", "reuse") != "off":
+            self.near_duplicates = NearDuplicateIndex()
+
+        # Request/token counters for throughput reporting
+        self.usage_lock = threading.Lock()
+        self.usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def _complete(self, prompt):
+        """Send a single-message chat completion and record its token usage"""
+        with metrics.span("llm_request", model=self.model):
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=self.temperature,
+            )
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        with self.usage_lock:
+            self.usage["requests"] += 1
+            self.usage["prompt_tokens"] += prompt_tokens
+            self.usage["completion_tokens"] += completion_tokens
+        metrics.incr("llm_tokens_total", prompt_tokens, direction="prompt")
+        metrics.incr("llm_tokens_total", completion_tokens, direction="completion")
+        return response
+
+    def _cached_analysis(self, comment_hash):
+        """Look up a comment's analysis from either the single or batched prompt"""
+        for prompt_fingerprint in (
+            ANALYSIS_PROMPT_FINGERPRINT,
+            BATCH_ANALYSIS_PROMPT_FINGERPRINT,
+        ):
+            analysis = self.cache.get(
+                comment_hash, prompt_fingerprint, self.model, self.temperature
+            )
+            if is_valid_analysis(analysis):
                 return analysis
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    print(f"Attempt {attempt + 1} failed: {str(e)}")
-                    print(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    print(f"Failed after {max_retries} attempts: {str(e)}")
-                    return None
+        return None
+
+    def analyze_post(self, content, comment_hash=None):
+        """
+        Analyze a single comment, serving repeated inputs from the response cache.
+
+        Args:
+            content (str): Comment text
+            comment_hash (str): SHA-256 of the comment body; computed from
+                content when not given
+        """
+        comment_hash = comment_hash or content_hash(content)
+        analysis = self._cached_analysis(comment_hash)
+        if analysis is not None:
+            logger.debug("Cache hit for comment %s", comment_hash[:12])
+            return analysis
+
+        prompt = ANALYSIS_PROMPT.format(content=self.budget.fit("analysis", content))
+
+        def request():
+            return self._complete(prompt)
+
+        def parse(response):
+            # Get the response content and clean it up
+            message_content = response.choices[0].message.content
+            logger.debug("Message content: %s", message_content)
+            analysis = json.loads(self._strip_code_fence(message_content))
+            # Raised here, a malformed reply is retried and never cached
+            if not is_valid_analysis(analysis):
+                raise ValueError(f"Malformed analysis: {message_content[:200]}")
+            return analysis
+
+        # Budget for the prompt plus a completion of roughly the same size
+        try:
+            analysis = self.scheduler.call(
+                request,
+                estimated_tokens=self.budget.record("analysis", prompt) * 2,
+                parse=parse,
+            )
+        except Exception:
+            return None
+
+        self.cache.put(
+            comment_hash,
+            ANALYSIS_PROMPT_FINGERPRINT,
+            self.model,
+            self.temperature,
+            analysis,
+        )
+        logger.debug("Analyzed comment %s: %s", comment_hash[:12], analysis)
+        return analysis
+
+    def pack_batches(self, items, token_budget=None, max_items=None, token_counts=None):
+        """
+        Greedily pack (comment_hash, content) items into batches whose comment
+        text stays within token_budget prompt tokens.
+
+        A single comment larger than the budget still gets a batch of its own.
+        The budget is capped so that batch prompts stay within
+        PROMPT_MAX_TOKENS, and comments count at most the
+        PROMPT_MAX_CONTENT_TOKENS analyze_batch truncates them to.
+
+        Args:
+            token_counts (dict): comment_hash -> tokens already counted by
+                the preprocessor; other items are estimated here
+        """
+        token_counts = token_counts or {}
+        token_budget = min(
+            token_budget or self.batch_token_budget,
+            self.budget.max_prompt_tokens - estimate_tokens(BATCH_ANALYSIS_PROMPT),
+        )
+        max_items = max_items or self.batch_max_items
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for comment_hash, content in items:
+            tokens = token_counts.get(comment_hash)
+            if tokens is None:
+                tokens = min(estimate_tokens(content), self.budget.max_content_tokens)
+            if batch and (
+                batch_tokens + tokens > token_budget or len(batch) >= max_items
+            ):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append((comment_hash, content))
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def analyze_batch(self, items):
+        """
+        Analyze several comments with one request.
+
+        Items are addressed in the prompt by the first BATCH_ID_LENGTH
+        characters of their comment_hash. Items the model drops or mangles
+        are retried individually through analyze_post.
+
+        Args:
+            items (list): (comment_hash, content) pairs
+
+        Returns:
+            dict: comment_hash -> analysis dict, or None when analysis failed
+        """
+        results = {}
+        pending = {}
+        for comment_hash, content in items:
+            comment_hash = comment_hash or content_hash(content)
+            analysis = self._cached_analysis(comment_hash)
+            if analysis is not None:
+                results[comment_hash] = analysis
+            else:
+                # Identical hashes mean identical text, so one entry serves both
+                pending[comment_hash[:BATCH_ID_LENGTH]] = (comment_hash, content)
+
+        if not pending:
+            return results
+
+        comments = "\n".join(
+            f"[{item_id}] {self.budget.fit('batch', content)}"
+            for item_id, (_, content) in pending.items()
+        )
+        prompt = BATCH_ANALYSIS_PROMPT.format(comments=comments)
+
+        def parse(response):
+            parsed = json.loads(
+                self._strip_code_fence(response.choices[0].message.content)
+            )
+            if not isinstance(parsed, dict) or not isinstance(
+                parsed.get("results"), list
+            ):
+                raise ValueError("Batch response has no results list")
+            return parsed["results"]
+
+        try:
+            batch_results = self.scheduler.call(
+                lambda: self._complete(prompt),
+                estimated_tokens=self.budget.record("batch", prompt) * 2,
+                parse=parse,
+            )
+        except Exception:
+            batch_results = []
+
+        for item in batch_results:
+            if not isinstance(item, dict):
+                continue
+            item_id = str(item.pop("id", "")).strip("[] ")
+            if item_id not in pending or not is_valid_analysis(item):
+                continue
+            comment_hash, _ = pending.pop(item_id)
+            results[comment_hash] = item
+            self.cache.put(
+                comment_hash,
+                BATCH_ANALYSIS_PROMPT_FINGERPRINT,
+                self.model,
+                self.temperature,
+                item,
+            )
+
+        if pending:
+            logger.warning(
+                f"Batch response missing {len(pending)} of {len(items)} items, "
+                "retrying them individually"
+            )
+        for comment_hash, content in pending.values():
+            results[comment_hash] = self.analyze_post(content, comment_hash)
+
+        return results
+
+    def _strip_code_fence(self, message_content):
+        """Remove markdown code blocks if present"""
+        cleaned_content = message_content.strip()
+        if cleaned_content.startswith("```json"):
+            cleaned_content = cleaned_content[7:]  # Remove ```json
+        if cleaned_content.endswith("```"):
+            cleaned_content = cleaned_content[:-3]  # Remove ```
+        return cleaned_content.strip()
 
     def create_analyzed_column(self, csv_path, new_column, analysis_prompt):
         """
@@ -90,71 +401,168 @@ class LLMAnalyzer:
         if new_column not in df.columns:
             df[new_column] = pd.Series(dtype="str")
 
+        prompt_fingerprint = fingerprint(analysis_prompt)
+        prepared = self.preprocessor.preprocess(df["content"])
+        self._record_truncations("column", prepared)
+        if "comment_hash" in df.columns:
+            hashes = df["comment_hash"].tolist()
+        else:
+            hashes = [None] * len(df)
+
+        # Results are collected in order and assigned as one column at the end
+        values = []
+
         # Analyze each row
-        for idx, row in df.iterrows():
-            print(f"\n{'='*50}")
-            print(f"Analyzing row {idx + 1}/{len(df)}")
+        for position, (content, comment_hash, prepared_hash) in enumerate(
+            zip(prepared["text"].tolist(), hashes, prepared["comment_hash"].tolist())
+        ):
+            log_sampled(
+                logger,
+                logging.INFO,
+                "create_analyzed_column",
+                "Analyzing row %d/%d",
+                position + 1,
+                len(df),
+            )
+
+            if not isinstance(comment_hash, str):
+                comment_hash = prepared_hash
+            cache_key = (comment_hash, prompt_fingerprint, self.model, self.temperature)
+            cached = self.cache.get(*cache_key)
+            if cached is not None:
+                values.append(cached)
+                logger.debug("Cache hit: %s...", cached[:200])
+                continue
 
             # Format the analysis prompt with row content
-            prompt = analysis_prompt.format(content=row["content"])
+            prompt = analysis_prompt.format(content=content)
+
+            try:
+                response = self.scheduler.call(
+                    lambda: self._complete(prompt),
+                    estimated_tokens=self.budget.record("column", prompt) * 2,
+                )
+            except Exception:
+                values.append("Analysis failed")
+                continue
 
-            max_retries = 3
-            retry_delay = 2
+            # Get and clean the response
+            cleaned_content = self._strip_code_fence(
+                response.choices[0].message.content
+            )
 
-            for attempt in range(max_retries):
-                try:
-                    response = self.client.chat.completions.create(
-                        model="deepseek-chat",
-                        messages=[{"role": "user", "content": prompt}],
-                        temperature=0.7,
-                    )
+            # Parse JSON response
+            try:
+                analysis = json.loads(cleaned_content)
 
-                    # Get and clean the response
-                    message_content = response.choices[0].message.content
-                    cleaned_content = message_content.strip()
-
-                    # Parse JSON response
-                    try:
-                        # Remove markdown code blocks if present
-                        if cleaned_content.startswith("```json"):
-                            cleaned_content = cleaned_content[7:]
-                        if cleaned_content.endswith("```"):
-                            cleaned_content = cleaned_content[:-3]
-                        cleaned_content = cleaned_content.strip()
-
-                        analysis = json.loads(cleaned_content)
-
-                        # Format as text with feature, description pairs
-                        formatted_text = []
-                        for feature, description in analysis.items():
-                            formatted_text.append(f"{feature}, {description}")
-
-                        # Join with newlines and update dataframe
-                        df.at[idx, new_column] = "\n".join(formatted_text)
-                        print(f"Analysis result: {formatted_text[:200]}...")
-                        break
+                # Format as text with feature, description pairs
+                formatted_text = []
+                for feature, description in analysis.items():
+                    formatted_text.append(f"{feature}, {description}")
 
-                    except json.JSONDecodeError:
-                        # If not JSON, store raw text
-                        df.at[idx, new_column] = cleaned_content
-                        print(f"Analysis result: {cleaned_content[:200]}...")
-                        break
+                # Join with newlines
+                value = "\n".join(formatted_text)
+                logger.debug("Analysis result: %s...", formatted_text[:200])
 
-                except Exception as e:
-                    if attempt < max_retries - 1:
-                        print(f"Attempt {attempt + 1} failed: {str(e)}")
-                        print(f"Retrying in {retry_delay} seconds...")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2
-                    else:
-                        print(f"Failed after {max_retries} attempts: {str(e)}")
-                        df.at[idx, new_column] = "Analysis failed"
+            except (json.JSONDecodeError, AttributeError):
+                # If not a JSON object, store raw text
+                value = cleaned_content
+                logger.debug("Analysis result: %s...", cleaned_content[:200])
+
+            values.append(value)
+            self.cache.put(*cache_key, value)
+
+        df[new_column] = values
 
         # Save the updated dataframe
         df.to_csv(csv_path, index=False)
-        print(f"\nAnalysis complete. Results saved to {csv_path}")
+        self.cache.evict()
+        logger.info(f"Analysis complete. Results saved to {csv_path}")
+        logger.info(f"Cache stats: {self.cache.stats()}")
+
+    def _record_truncations(self, kind, prepared):
+        """Count and log the comments the preprocessor truncated"""
+        truncated = prepared["truncated_tokens"] > 0
+        if not truncated.any():
+            return
+        self.budget.record_truncation(
+            kind, int(truncated.sum()), int(prepared["truncated_tokens"].sum())
+        )
+        logger.info(
+            f"Truncated {truncated.sum()} comments over "
+            f"{self.budget.max_content_tokens} tokens, removing "
+            f"{prepared['truncated_tokens'].sum()} tokens"
+        )
+
+    def _log_analysis(self, idx, analysis):
+        """Log a single analysis result at DEBUG level, or a failure for row idx"""
+        if not analysis:
+            logger.warning(f"Analysis failed for row {idx + 1}")
+            metrics.incr("rows_processed_total", stage="analyze", outcome="failed")
+            return
+        metrics.incr("rows_processed_total", stage="analyze", outcome="analyzed")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "LLM analysis output for row %d: %s",
+                idx + 1,
+                json.dumps(
+                    {
+                        "pain_points": analysis["pain_points"],
+                        "gain_points": analysis["gain_points"],
+                        "jobs_to_be_done": analysis["jobs_to_be_done"],
+                        "themes": analysis["themes"],
+                        "relevance_score": analysis["relevance_score"],
+                    },
+                    indent=2,
+                ),
+            )
+
+    def _report_throughput(self, comments, usage_before, started_at):
+        """Log comments/sec and tokens per comment for the finished run"""
+        elapsed = time.perf_counter() - started_at
+        requests = self.usage["requests"] - usage_before["requests"]
+        tokens = (
+            self.usage["prompt_tokens"]
+            + self.usage["completion_tokens"]
+            - usage_before["prompt_tokens"]
+            - usage_before["completion_tokens"]
+        )
+        if not comments:
+            return
+        logger.info(
+            f"Analyzed {comments} comments with {requests} requests in {elapsed:.1f}s: "
+            f"{comments / elapsed if elapsed else 0:.2f} comments/sec, "
+            f"{tokens / comments:.0f} tokens per comment"
+        )
+
+    def analyze_dataframe(
+        self,
+        csv_path,
+        max_workers=None,
+        batch_token_budget=None,
+        checkpoint_interval=None,
+    ):
+        """
+        Analyze every unscanned row of a CSV file and save the relevant ones.
+
+        Args:
+            csv_path (str): Path to the CSV file
+            max_workers (int): Maximum number of concurrent LLM requests,
+                defaults to the analyzer's max_workers
+            batch_token_budget (int): Pack comments into batched requests of
+                about this many prompt tokens; defaults to LLM_BATCH_TOKEN_BUDGET,
+                and 0 sends one comment per request
+            checkpoint_interval (int): Rewrite the CSV after this many analyzed
+                rows; defaults to ANALYSIS_CHECKPOINT_INTERVAL, and 0 writes it
+                only once at the end. Progress in between lives in an
+                append-only journal next to the CSV.
+        """
+        max_workers = max_workers or self.max_workers
+        if batch_token_budget is None:
+            batch_token_budget = self.batch_token_budget
+        if checkpoint_interval is None:
+            checkpoint_interval = self.checkpoint_interval
 
-    def analyze_dataframe(self, csv_path):
         # Read the CSV file
         df = pd.read_csv(csv_path)
 
@@ -174,60 +582,242 @@ class LLMAnalyzer:
         if "relevance_score" not in df.columns:
             df["relevance_score"] = pd.Series(dtype="float64")
 
-        # Analyze each unscanned row
-        for idx, row in df.iterrows():
-            if row["scanned"] == "N":
-                print(f"\n{'='*50}")
-                print(f"Analyzing row {idx + 1}/{len(df)}")
-                print(f"Content: {row['content'][:200]}...")
-                analysis = self.analyze_post(row["content"])
-
-                if analysis:
-                    print("\nLLM Analysis Output:")
-                    print(
-                        json.dumps(
-                            {
-                                "pain_points": analysis["pain_points"],
-                                "gain_points": analysis["gain_points"],
-                                "jobs_to_be_done": analysis["jobs_to_be_done"],
-                                "themes": analysis["themes"],
-                                "relevance_score": analysis["relevance_score"],
-                            },
-                            indent=2,
-                        )
-                    )
+        pending = df.index[df["scanned"] == "N"]
+
+        # Content hashes, the normalized text sent to the LLM and its token
+        # count, computed off this thread on the preprocessing pool
+        prepared = self.preprocessor.preprocess(df.loc[pending, "content"])
+        self._record_truncations("analysis", prepared)
+        texts = prepared["text"].to_dict()
+        if "comment_hash" in df.columns:
+            pending_hashes = df.loc[pending, "comment_hash"]
+        else:
+            pending_hashes = pd.Series(None, index=pending, dtype="object")
+        missing = ~pending_hashes.map(lambda h: isinstance(h, str)).astype(bool)
+        pending_hashes[missing] = prepared.loc[missing[missing].index, "comment_hash"]
+        hashes = pending_hashes.to_dict()
+
+        # Resume from the journal of an interrupted run
+        journal = CheckpointJournal.for_csv(csv_path)
+        journaled = {
+            comment_hash: analysis
+            for comment_hash, analysis in journal.load().items()
+            if is_valid_analysis(analysis)
+        }
+        results = AnalysisResults()
+        resumed = [idx for idx in pending if hashes[idx] in journaled]
+        for idx in resumed:
+            results.add(idx, journaled[hashes[idx]])
+        if resumed:
+            logger.info(f"Resumed {len(resumed)} rows from {journal.path}")
+            metrics.incr(
+                "rows_processed_total", len(resumed), stage="analyze", outcome="resumed"
+            )
+            pending = pending.difference(resumed)
+
+        # Keep obviously irrelevant comments away from the LLM
+        prefiltered = set()
+        if self.prefilter.mode != "off" and len(pending):
+            reasons = self.prefilter.reasons(df.loc[pending, "content"]).dropna()
+            prefiltered = set(reasons.index)
+            logger.info(
+                f"Prefilter ({self.prefilter.mode}) flagged {len(reasons)} of "
+                f"{len(pending)} rows ({len(reasons) / len(pending):.0%} of calls): "
+                f"{reasons.value_counts().to_dict()}"
+            )
+            if self.prefilter.mode == "skip":
+                skipped = {field: [] for field in LIST_FIELDS}
+                skipped["relevance_score"] = SKIPPED_RELEVANCE
+                for idx in reasons.index:
+                    results.add(idx, skipped)
+                pending = pending.difference(reasons.index)
+                metrics.incr(
+                    "rows_processed_total",
+                    len(reasons),
+                    stage="analyze",
+                    outcome="prefiltered",
+                )
+        relevant_rows = 0
+        relevant_flagged = 0
+
+        # Near duplicates: rows copying the analysis of an earlier comment in
+        # this run (followers, keyed by that comment's hash) or of one
+        # analyzed in a previous run (served from the response cache)
+        follower_rows = {}
+        fingerprints = {}
+        if self.near_duplicates is not None and len(pending):
+            first_rows = {}
+            for idx in pending:
+                first_rows.setdefault(hashes[idx], idx)
+            fingerprints = dict(
+                zip(
+                    first_rows,
+                    simhashes(df.loc[list(first_rows.values()), "content"].tolist()),
+                )
+            )
+            leaders = group_near_duplicates(
+                fingerprints, self.near_duplicates.max_distance
+            )
+            followers = {}
+            for comment_hash, leader in leaders.items():
+                followers.setdefault(leader, []).append(comment_hash)
+
+            reused = {}
+            for comment_hash, value in fingerprints.items():
+                if value is None or comment_hash in leaders:
+                    continue
+                for match, _ in self.near_duplicates.find(value, exclude=comment_hash):
+                    analysis = self._cached_analysis(match)
+                    if analysis is not None:
+                        for h in [comment_hash] + followers.pop(comment_hash, []):
+                            journal.append(h, analysis)
+                            reused[h] = analysis
+                        break
 
-                    df.at[idx, "pain_points"] = ", ".join(analysis["pain_points"])
-                    df.at[idx, "gain_points"] = ", ".join(analysis["gain_points"])
-                    df.at[idx, "jobs_to_be_done"] = ", ".join(
-                        analysis["jobs_to_be_done"]
+            # Rows of followers wait for their leader's result
+            follower_of = {h: leader for leader, hs in followers.items() for h in hs}
+            skipped_rows = []
+            for idx in pending:
+                comment_hash = hashes[idx]
+                if comment_hash in reused:
+                    results.add(idx, reused[comment_hash])
+                    metrics.incr(
+                        "rows_processed_total",
+                        stage="analyze",
+                        outcome="near_duplicate",
+                    )
+                elif comment_hash in follower_of:
+                    follower_rows.setdefault(follower_of[comment_hash], []).append(
+                        (idx, comment_hash)
                     )
-                    df.at[idx, "themes"] = ", ".join(analysis["themes"])
-                    df.at[idx, "relevance_score"] = analysis["relevance_score"]
                 else:
-                    print(f"Analysis failed for row {idx + 1}")
-                    df.at[idx, "pain_points"] = ""
-                    df.at[idx, "gain_points"] = ""
-                    df.at[idx, "jobs_to_be_done"] = ""
-                    df.at[idx, "themes"] = ""
-                    df.at[idx, "relevance_score"] = 0.1
-
-                df.at[idx, "scanned"] = "Y"
+                    continue
+                skipped_rows.append(idx)
+            logger.info(
+                f"Near duplicates: {len(reused)} comments reuse an earlier "
+                f"analysis, {len(follower_of)} copy another comment of this run"
+            )
+            pending = pending.difference(skipped_rows)
+
+        # Fan out the unscanned rows over a bounded pool of workers. Results
+        # are written back from this thread only, keyed by the row index.
+        logger.info(
+            f"Skipping {len(df) - len(pending)} already analyzed rows, "
+            f"analyzing {len(pending)} rows with {max_workers} workers"
+        )
 
-                # Save progress after each analysis
-                df.to_csv(csv_path, index=False)
+        usage_before = dict(self.usage)
+        analyzed_hashes = set()
+        started_at = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Each future resolves to {comment_hash: analysis} for its rows
+            futures = {}
+            if batch_token_budget:
+                rows_by_hash = {}
+                for idx in pending:
+                    rows_by_hash.setdefault(hashes[idx], []).append(idx)
+                batches = self.pack_batches(
+                    [(h, texts[rows[0]]) for h, rows in rows_by_hash.items()],
+                    token_budget=batch_token_budget,
+                    token_counts={
+                        h: prepared.at[rows[0], "tokens"]
+                        for h, rows in rows_by_hash.items()
+                    },
+                )
+                logger.info(
+                    f"Packed {len(rows_by_hash)} comments into {len(batches)} batches"
+                )
+                for batch in batches:
+                    future = executor.submit(self.analyze_batch, batch)
+                    futures[future] = [
+                        (idx, h) for h, _ in batch for idx in rows_by_hash[h]
+                    ]
             else:
-                print(f"Skipping already analyzed row {idx + 1}")
+                for idx in pending:
+                    future = executor.submit(
+                        lambda content, h: {h: self.analyze_post(content, h)},
+                        texts[idx],
+                        hashes[idx],
+                    )
+                    futures[future] = [(idx, hashes[idx])]
+
+            completed = 0
+            for future in as_completed(futures):
+                try:
+                    analyses = future.result()
+                except Exception as e:
+                    logger.error(f"Unexpected error analyzing rows: {str(e)}")
+                    analyses = {}
+
+                for idx, comment_hash in futures[future]:
+                    completed += 1
+                    log_sampled(
+                        logger,
+                        logging.INFO,
+                        "analyze_dataframe",
+                        "Analyzed row %d/%d (%d/%d)",
+                        idx + 1,
+                        len(df),
+                        completed,
+                        len(pending),
+                    )
+                    analysis = analyses.get(comment_hash)
+                    if analysis is not None:
+                        analyzed_hashes.add(comment_hash)
+                    journal.append(comment_hash, analysis)
+                    self._log_analysis(idx, analysis)
+                    results.add(idx, analysis)
+                    if analysis and float(analysis["relevance_score"]) >= 0.5:
+                        relevant_rows += 1
+                        relevant_flagged += idx in prefiltered
+
+                    for follower_idx, follower_hash in follower_rows.pop(
+                        comment_hash, []
+                    ):
+                        journal.append(follower_hash, analysis)
+                        metrics.incr(
+                            "rows_processed_total",
+                            stage="analyze",
+                            outcome="near_duplicate",
+                        )
+                        results.add(follower_idx, analysis)
+
+                    if checkpoint_interval and completed % checkpoint_interval == 0:
+                        results.apply(df)
+                        df.to_csv(csv_path, index=False)
+
+        self._report_throughput(len(pending), usage_before, started_at)
+        if self.near_duplicates is not None:
+            # Only comments whose analysis is in the response cache can be
+            # reused by later runs
+            self.near_duplicates.add(
+                {h: value for h, value in fingerprints.items() if h in analyzed_hashes}
+            )
+        if self.prefilter.mode == "shadow" and relevant_rows:
+            logger.info(
+                f"Prefilter (shadow) would have lost {relevant_flagged} of "
+                f"{relevant_rows} relevant rows "
+                f"({relevant_flagged / relevant_rows:.0%} recall lost)"
+            )
+
+        # Materialize the full table once; the journal is no longer needed
+        results.apply(df)
+        df.to_csv(csv_path, index=False)
+        journal.discard()
 
         # Filter for relevance score >= 0.5
-        filtered_df = df[df["relevance_score"] >= 0.5]
+        relevance = pd.to_numeric(df["relevance_score"], errors="coerce")
+        filtered_df = df[relevance >= 0.5]
 
         # Save analyzed data with -staging suffix
         output_path = csv_path.rsplit(".", 1)[0] + "-staging.csv"
         filtered_df.to_csv(output_path, index=False)
-        print(
-            f"\nAnalysis complete. {len(filtered_df)} relevant entries saved to {output_path}"
+        self.cache.evict()
+        logger.info(
+            f"Analysis complete. {len(filtered_df)} relevant entries saved to {output_path}"
         )
+        logger.info(f"Cache stats: {self.cache.stats()}")
         return filtered_df
 
 
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from instrumentation import get_logger, get_metrics
+
+load_dotenv()
+
+logger = get_logger(__name__)
+metrics = get_metrics()
+
+
+def fingerprint(text):
+    """SHA-256 of a prompt template, so edited prompts never hit stale entries"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Persistent SQLite cache of parsed LLM responses.
+
+    Entries are keyed on (comment_hash, prompt fingerprint, model, temperature)
+    so re-runs and backfills over the same comments never pay for the same
+    call twice. Entries older than max_age_days are dropped and the cache is
+    trimmed to max_entries, least recently used first.
+    """
+
+    def __init__(self, path=None, max_entries=None, max_age_days=None):
+        self.path = path or os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+        self.max_entries = max_entries or int(
+            os.getenv("LLM_CACHE_MAX_ENTRIES", "500000")
+        )
+        self.max_age_days = max_age_days or float(
+            os.getenv("LLM_CACHE_MAX_AGE_DAYS", "90")
+        )
+        self.hits = 0
+        self.misses = 0
+
+        # One connection shared by the analyzer's worker threads
+        self.lock = threading.Lock()
+        # Parallel DAG shards share this file: wait for each other's write
+        # locks instead of failing, and let readers run alongside a writer
+        self.conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            timeout=float(os.getenv("SQLITE_BUSY_TIMEOUT", "60")),
+        )
+        mode = self.conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if mode.lower() != "wal":
+            logger.warning(
+                f"{self.path} is in {mode} journal mode, not WAL; parallel "
+                "shards will block each other"
+            )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                comment_hash TEXT NOT NULL,
+                prompt_fingerprint TEXT NOT NULL,
+                model TEXT NOT NULL,
+                temperature REAL NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (comment_hash, prompt_fingerprint, model, temperature)
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_responses_accessed_at "
+            "ON llm_responses (accessed_at)"
+        )
+        self.conn.commit()
+
+    def get(self, comment_hash, prompt_fingerprint, model, temperature):
+        """Return the cached response for the key, or None on a miss"""
+        key = (comment_hash, prompt_fingerprint, model, float(temperature))
+        with self.lock:
+            row = self.conn.execute(
+                """
+                SELECT response FROM llm_responses
+                WHERE comment_hash = ? AND prompt_fingerprint = ?
+                  AND model = ? AND temperature = ?
+                """,
+                key,
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.incr("llm_cache_lookups_total", result="miss")
+                return None
+
+            self.hits += 1
+            metrics.incr("llm_cache_lookups_total", result="hit")
+            self.conn.execute(
+                """
+                UPDATE llm_responses SET accessed_at = ?
+                WHERE comment_hash = ? AND prompt_fingerprint = ?
+                  AND model = ? AND temperature = ?
+                """,
+                (time.time(),) + key,
+            )
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, comment_hash, prompt_fingerprint, model, temperature, response):
+        """Store a JSON-serializable response under the key"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO llm_responses
+                (comment_hash, prompt_fingerprint, model, temperature,
+                 response, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    comment_hash,
+                    prompt_fingerprint,
+                    model,
+                    float(temperature),
+                    json.dumps(response),
+                    now,
+                    now,
+                ),
+            )
+            self.conn.commit()
+
+    def evict(self):
+        """Drop expired entries, then trim to max_entries. Returns rows removed."""
+        cutoff = time.time() - self.max_age_days * 86400
+        with self.lock:
+            expired = self.conn.execute(
+                "DELETE FROM llm_responses WHERE created_at < ?", (cutoff,)
+            ).rowcount
+            overflow = self.conn.execute(
+                """
+                DELETE FROM llm_responses WHERE rowid IN (
+                    SELECT rowid FROM llm_responses
+                    ORDER BY accessed_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            ).rowcount
+            self.conn.commit()
+        return expired + overflow
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute(
+                "SELECT COUNT(*) FROM llm_responses"
+            ).fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
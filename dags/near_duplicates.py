@@ -0,0 +1,274 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from instrumentation import get_logger
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+URL_PATTERN = re.compile(r"https?://\S+")
+
+SIMHASH_BITS = 64
+# Four 16-bit bands: by pigeonhole, two fingerprints within 3 bits of each
+# other agree on at least one band, so band lookups find every such pair
+BANDS = 4
+BAND_BITS = SIMHASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Texts whose feature bits are unpacked at once, to bound memory
+WEIGH_CHUNK_SIZE = 10000
+
+
+_word_hashes = {}
+
+
+def _word_hash(word):
+    value = _word_hashes.get(word)
+    if value is None:
+        value = int.from_bytes(
+            hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little"
+        )
+        _word_hashes[word] = value
+    return value
+
+
+def _mix(x):
+    """splitmix64 finalizer, vectorized over a uint64 array"""
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def simhashes(texts, min_words=None):
+    """
+    64-bit SimHash of each text over its words and adjacent word pairs, or
+    None when it has fewer than min_words words (fingerprints of very short
+    texts collide too easily to be useful).
+
+    Texts are tokenized with vectorized pandas string methods and only
+    distinct words are hashed in Python. Word pair hashes are derived from
+    them and the features of a whole batch are weighed at once in NumPy.
+    """
+    if min_words is None:
+        min_words = int(os.getenv("NEAR_DUP_MIN_WORDS", "8"))
+
+    words = (
+        pd.Series(list(texts), dtype="object")
+        .astype(str)
+        .str.lower()
+        .str.replace(URL_PATTERN, " ", regex=True)
+        .str.findall(WORD_PATTERN)
+    )
+    fingerprints = [None] * len(words)
+    eligible = words[words.str.len() >= min_words].explode()
+    if eligible.empty:
+        return fingerprints
+
+    # Hash each distinct word once
+    codes, distinct = pd.factorize(eligible.to_numpy())
+    distinct_hashes = np.fromiter(
+        (_word_hash(word) for word in distinct), dtype=np.uint64, count=len(distinct)
+    )
+    word_hashes = distinct_hashes[codes]
+    text_ids = eligible.index.to_numpy()
+
+    # Pairs of consecutive words of the same text
+    same_text = text_ids[:-1] == text_ids[1:]
+    first, second = word_hashes[:-1][same_text], word_hashes[1:][same_text]
+    rotated = (second << np.uint64(1)) | (second >> np.uint64(63))
+    features = np.concatenate([word_hashes, _mix(first ^ rotated)])
+    feature_text_ids = np.concatenate([text_ids, text_ids[:-1][same_text]])
+
+    # Group the features by text, then take the per-bit majority text by text
+    order = np.argsort(feature_text_ids, kind="stable")
+    features = features[order].astype("<u8")
+    feature_text_ids = feature_text_ids[order]
+    starts = np.flatnonzero(np.r_[True, feature_text_ids[1:] != feature_text_ids[:-1]])
+    sizes = np.diff(np.r_[starts, len(features)])
+    values = np.empty(len(starts), dtype="<u8")
+    for begin in range(0, len(starts), WEIGH_CHUNK_SIZE):
+        end = min(begin + WEIGH_CHUNK_SIZE, len(starts))
+        low = starts[begin]
+        high = starts[end] if end < len(starts) else len(features)
+        bits = np.unpackbits(
+            features[low:high].view(np.uint8).reshape(-1, 8),
+            axis=1,
+            bitorder="little",
+        )
+        ones = np.add.reduceat(bits, starts[begin:end] - low, axis=0, dtype=np.int32)
+        majority = ones * 2 > sizes[begin:end, None]
+        values[begin:end] = (
+            np.packbits(majority, axis=1, bitorder="little").view("<u8").ravel()
+        )
+
+    for text_id, value in zip(feature_text_ids[starts].tolist(), values.tolist()):
+        fingerprints[text_id] = value
+    return fingerprints
+
+
+def simhash(text, min_words=None):
+    """SimHash of a single text, see simhashes()"""
+    return simhashes([text], min_words)[0]
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _bands(fingerprint):
+    return [(fingerprint >> (i * BAND_BITS)) & BAND_MASK for i in range(BANDS)]
+
+
+def _to_signed(fingerprint):
+    # SQLite integers are signed 64-bit
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def group_near_duplicates(fingerprints, max_distance=3):
+    """
+    Cluster fingerprints that are within max_distance bits of each other.
+
+    Args:
+        fingerprints (dict): key -> simhash (None values are left alone)
+
+    Returns:
+        dict: key -> key of its cluster's first member, for every key that
+        has a near duplicate earlier in the input
+    """
+    parent = {}
+
+    def find(key):
+        while parent.get(key, key) != key:
+            key = parent[key]
+        return key
+
+    buckets = {}
+    order = {}
+    for position, (key, fingerprint) in enumerate(fingerprints.items()):
+        if fingerprint is None:
+            continue
+        order[key] = position
+        for band, value in enumerate(_bands(fingerprint)):
+            for other in buckets.get((band, value), []):
+                if hamming(fingerprint, fingerprints[other]) > max_distance:
+                    continue
+                root, other_root = find(key), find(other)
+                if root != other_root:
+                    # Keep the earliest member as the root of the cluster
+                    if order[root] < order[other_root]:
+                        root, other_root = other_root, root
+                    parent[root] = other_root
+            buckets.setdefault((band, value), []).append(key)
+
+    return {key: find(key) for key in order if find(key) != key}
+
+
+class NearDuplicateIndex:
+    """
+    Persistent SimHash index of analyzed comments.
+
+    Each fingerprint is stored with its four 16-bit bands, each indexed, so a
+    lookup only compares against the stored fingerprints sharing a band and
+    stays fast with hundreds of thousands of comments.
+    """
+
+    def __init__(self, path=None, max_distance=None):
+        self.path = path or os.getenv("NEAR_DUP_INDEX_PATH", "near_duplicates.sqlite3")
+        if max_distance is None:
+            max_distance = int(os.getenv("NEAR_DUP_MAX_DISTANCE", "3"))
+        self.max_distance = max_distance
+        self.lock = threading.Lock()
+        # Parallel DAG shards share this file: wait for each other's write
+        # locks instead of failing, and let readers run alongside a writer
+        self.conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            timeout=float(os.getenv("SQLITE_BUSY_TIMEOUT", "60")),
+        )
+        mode = self.conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if mode.lower() != "wal":
+            logger.warning(
+                f"{self.path} is in {mode} journal mode, not WAL; parallel "
+                "shards will block each other"
+            )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS simhashes (
+                comment_hash TEXT PRIMARY KEY,
+                simhash INTEGER NOT NULL,
+                band0 INTEGER NOT NULL,
+                band1 INTEGER NOT NULL,
+                band2 INTEGER NOT NULL,
+                band3 INTEGER NOT NULL,
+                added_at REAL
+            ) WITHOUT ROWID
+            """
+        )
+        for band in range(BANDS):
+            self.conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_simhashes_band{band} "
+                f"ON simhashes (band{band})"
+            )
+        self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            row = self.conn.execute("SELECT COUNT(*) FROM simhashes").fetchone()
+        return row[0]
+
+    def find(self, fingerprint, exclude=None):
+        """
+        Stored comments within max_distance bits of fingerprint.
+
+        Returns:
+            list: (comment_hash, distance) pairs, nearest first
+        """
+        if fingerprint is None:
+            return []
+        with self.lock:
+            rows = self.conn.execute(
+                " UNION ".join(
+                    f"SELECT comment_hash, simhash FROM simhashes WHERE band{band} = ?"
+                    for band in range(BANDS)
+                ),
+                _bands(fingerprint),
+            ).fetchall()
+
+        matches = []
+        for comment_hash, value in rows:
+            if comment_hash == exclude:
+                continue
+            distance = hamming(fingerprint, _to_unsigned(value))
+            if distance <= self.max_distance:
+                matches.append((comment_hash, distance))
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+    def add(self, fingerprints):
+        """Store comment_hash -> simhash pairs (None fingerprints are skipped)"""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO simhashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (comment_hash, _to_signed(fingerprint), *_bands(fingerprint), now)
+                    for comment_hash, fingerprint in fingerprints.items()
+                    if fingerprint is not None
+                ),
+            )
+            self.conn.commit()
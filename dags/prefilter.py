@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from clustering import tokenize, vectorize
+from list_fields import LIST_FIELDS, decode_list
+
+load_dotenv()
+
+# Bodies Reddit leaves behind for deleted or moderated comments
+DELETED_BODIES = {"", "[deleted]", "[removed]", "deleted", "removed"}
+
+# Whole-comment replies that never carry a pain point, gain or job
+LOW_VALUE_PATTERN = re.compile(
+    r"^\W*(thanks?( you)?( so much)?|thx|ty|lol|lmao|haha+|same( here)?|this|"
+    r"\+1|agreed?|yes|no|yep|nope|ok(ay)?|wow|nice|cool|great|love (it|this)|"
+    r"following|saved|bump)\W*$",
+    re.IGNORECASE,
+)
+
+# Terms typical of comments worth analyzing for a journaling product. A hit
+# keeps a comment away from the classifier's skip threshold.
+DOMAIN_LEXICON = frozenset(
+    """
+    journal journaling journals diary notebook notebooks write writing wrote
+    entry entries prompt prompts reflect reflection habit habits routine
+    morning pages gratitude app apps digital paper pen therapy therapist
+    anxiety mood feelings emotions thoughts mental health track tracking
+    struggle struggling consistent consistency motivation memory memories
+    """.split()
+)
+
+# Relevance score given to comments the prefilter skips, below the 0.1 of
+# failed analyses so the two can be told apart
+SKIPPED_RELEVANCE = 0.0
+
+# Relevance score stored, with every list field empty, for failed analyses
+FAILED_RELEVANCE = 0.1
+
+
+def lexicon_hits(text):
+    """Number of distinct DOMAIN_LEXICON words in text"""
+    return len(DOMAIN_LEXICON.intersection(tokenize(str(text))))
+
+
+class Prefilter:
+    """
+    Cheap local relevance check run before a comment is sent to the LLM.
+
+    Deleted bodies, comments shorter than min_chars and stock replies such as
+    "thanks!" are always flagged. When a model trained with train() exists,
+    comments it scores below threshold are flagged too, unless they mention
+    a DOMAIN_LEXICON term.
+
+    Modes:
+        skip: flagged comments are not sent to the LLM
+        shadow: every comment is analyzed; the prefilter only reports the
+            calls it would have saved and the relevant comments it would
+            have lost
+        off: no prefiltering
+    """
+
+    def __init__(self, mode=None, min_chars=None, threshold=None, model_path=None):
+        self.mode = mode or os.getenv("PREFILTER_MODE", "shadow")
+        self.min_chars = min_chars or int(os.getenv("PREFILTER_MIN_CHARS", "20"))
+        if threshold is None:
+            threshold = float(os.getenv("PREFILTER_THRESHOLD", "0.05"))
+        self.threshold = threshold
+        self.model_path = model_path or os.getenv(
+            "PREFILTER_MODEL_PATH", "prefilter_model.npz"
+        )
+        self.model = None
+        if os.path.exists(self.model_path):
+            with np.load(self.model_path) as model:
+                self.model = {key: model[key] for key in model.files}
+
+    @staticmethod
+    def _features(texts, dimensions):
+        """Hashed term frequencies plus length and lexicon features"""
+        texts = [str(text) for text in texts]
+        vectors = vectorize(texts, dimensions=dimensions, idf=False)
+        lengths = np.log1p([len(text) for text in texts]) / 8
+        hits = np.minimum([lexicon_hits(text) for text in texts], 3) / 3
+        return np.hstack([vectors, np.column_stack([lengths, hits])]).astype(np.float32)
+
+    def rule_reasons(self, contents):
+        """
+        Reason each comment is flagged by the fixed rules, or None.
+
+        Args:
+            contents (Series): Comment bodies
+
+        Returns:
+            Series: "deleted", "too_short", "low_value" or None, same index
+        """
+        text = contents.fillna("").astype(str).str.strip()
+        reasons = pd.Series(None, index=contents.index, dtype="object")
+        reasons[text.str.len() < self.min_chars] = "too_short"
+        reasons[text.str.fullmatch(LOW_VALUE_PATTERN)] = "low_value"
+        reasons[text.str.lower().isin(DELETED_BODIES)] = "deleted"
+        return reasons
+
+    def scores(self, contents):
+        """Classifier probability of each comment being relevant, or None"""
+        if self.model is None or not len(contents):
+            return None
+        features = self._features(contents.tolist(), int(self.model["dimensions"]))
+        logits = features @ self.model["weights"] + self.model["bias"]
+        return pd.Series(1 / (1 + np.exp(-logits)), index=contents.index)
+
+    def reasons(self, contents, threshold=None):
+        """Why each comment should skip the LLM (see rule_reasons), or None"""
+        threshold = self.threshold if threshold is None else threshold
+        reasons = self.rule_reasons(contents)
+        scores = self.scores(contents)
+        if scores is not None:
+            no_lexicon = contents.fillna("").map(lexicon_hits) == 0
+            low = (scores < threshold) & no_lexicon & reasons.isna()
+            reasons[low] = "classifier"
+        return reasons
+
+    def train(self, csv_paths, dimensions=512, holdout=0.2, seed=0):
+        """
+        Fit the classifier on comments the LLM has already scored and save it.
+
+        Relevance is relevance_score >= 0.5. Use the full analyzed CSVs that
+        analyze_dataframe rewrites in place, not the -staging files, which
+        only hold the relevant rows. Prefiltered rows and failed analyses
+        (score 0.1 with every list field empty) carry no LLM verdict and are
+        left out.
+
+        Returns:
+            DataFrame: report() of the held-out rows
+        """
+        df = pd.concat([pd.read_csv(path) for path in csv_paths], ignore_index=True)
+        df = df[df["relevance_score"].notna() & (df["relevance_score"] > 0)]
+        df = df[~self._failed(df)]
+        df = df.drop_duplicates(subset="content")
+        labels = (df["relevance_score"] >= 0.5).to_numpy()
+        if labels.all() or not labels.any():
+            raise ValueError(
+                "Training needs both relevant and irrelevant comments; "
+                "pass the full analyzed CSVs rather than -staging files"
+            )
+
+        rng = np.random.default_rng(seed)
+        order = rng.permutation(len(df))
+        cut = int(len(df) * (1 - holdout))
+        train_rows, test_rows = order[:cut], order[cut:]
+
+        features = self._features(df["content"].tolist(), dimensions)
+        weights, bias = self._fit(features[train_rows], labels[train_rows])
+        self.model = {
+            "weights": weights,
+            "bias": np.float32(bias),
+            "dimensions": np.int64(dimensions),
+        }
+        report = self.report(df.iloc[test_rows])
+
+        # Keep the held-out numbers, but ship a model fit on every row
+        weights, bias = self._fit(features, labels)
+        self.model.update(weights=weights, bias=np.float32(bias))
+        np.savez(self.model_path, **self.model)
+        return report
+
+    @staticmethod
+    def _failed(df):
+        """Rows holding the fallback of a failed analysis"""
+        failed = np.isclose(df["relevance_score"], FAILED_RELEVANCE)
+        for field in LIST_FIELDS:
+            if field in df:
+                failed &= df[field].map(lambda value: not decode_list(value)).to_numpy()
+        return failed
+
+    @staticmethod
+    def _fit(features, labels, iterations=500, learning_rate=0.5, l2=1e-3):
+        """Class-balanced logistic regression by full-batch gradient descent"""
+        y = labels.astype(np.float32)
+        positive = y.mean()
+        sample_weights = np.where(y == 1, 0.5 / positive, 0.5 / (1 - positive))
+        weights = np.zeros(features.shape[1], dtype=np.float32)
+        bias = 0.0
+        for _ in range(iterations):
+            p = 1 / (1 + np.exp(-(features @ weights + bias)))
+            error = (p - y) * sample_weights
+            weights -= learning_rate * (
+                features.T @ error / len(y) + l2 * weights
+            ).astype(np.float32)
+            bias -= learning_rate * error.mean()
+        return weights, bias
+
+    def report(self, df, thresholds=(0.0, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5)):
+        """
+        Calls saved vs. recall lost on comments with a known relevance_score.
+
+        Returns:
+            DataFrame: one row per threshold with the share of comments
+            skipped (calls_saved) and of relevant comments among them
+            (recall_lost)
+        """
+        relevant = (df["relevance_score"] >= 0.5).to_numpy()
+        rows = []
+        for threshold in thresholds:
+            skipped = self.reasons(df["content"], threshold).notna().to_numpy()
+            rows.append(
+                {
+                    "threshold": threshold,
+                    "calls_saved": skipped.mean() if len(df) else 0.0,
+                    "recall_lost": (
+                        (skipped & relevant).sum() / relevant.sum()
+                        if relevant.any()
+                        else 0.0
+                    ),
+                }
+            )
+        return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    # python prefilter.py comments.csv [more.csv ...]
+    prefilter = Prefilter()
+    print(prefilter.train(sys.argv[1:]).to_string(index=False))
+    print(f"Saved prefilter model to {prefilter.model_path}")
@@ -0,0 +1,193 @@
+import hashlib
+import html
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from token_budget import PromptBudget, count_tokens
+
+load_dotenv()
+
+# Reddit markdown that carries no meaning for the analysis prompt
+ZERO_WIDTH_PATTERN = re.compile(r"[\u200b\u200c\u200d\u2060\ufeff]")
+LINK_PATTERN = re.compile(r"!?\[([^\]]*)\]\([^)\s]*(?:\s+\"[^\"]*\")?\)")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~).*$", re.MULTILINE)
+LINE_MARKUP_PATTERN = re.compile(
+    r"^[ \t]*(?:>+[ \t]?|#{1,6}[ \t]+|[-*+][ \t]+(?=\S))", re.MULTILINE
+)
+RULE_PATTERN = re.compile(r"^[ \t]*(?:[-*_][ \t]*){3,}$", re.MULTILINE)
+EMPHASIS_PATTERN = re.compile(r"(\*\*|__|~~|>!|!<|`)")
+SPACE_PATTERN = re.compile(r"[ \t\r\f\v]+")
+BLANK_LINES_PATTERN = re.compile(r"\n\s*\n+")
+
+
+def content_hash(text):
+    """Same SHA-256 as RedditScraper.generate_hash, of the raw comment body"""
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()
+
+
+def normalize_text(text):
+    """
+    Comment body as sent to the LLM: HTML entities decoded, markdown links
+    reduced to their text, quote, heading, list, emphasis, spoiler and code
+    markers dropped and whitespace collapsed (paragraph breaks are kept).
+    Text that would end up empty is returned stripped but otherwise as is.
+    """
+    text = str(text)
+    cleaned = html.unescape(ZERO_WIDTH_PATTERN.sub("", text))
+    cleaned = LINK_PATTERN.sub(r"\1", cleaned)
+    cleaned = FENCE_PATTERN.sub("", cleaned)
+    cleaned = RULE_PATTERN.sub("", cleaned)
+    cleaned = EMPHASIS_PATTERN.sub("", cleaned)
+    cleaned = LINE_MARKUP_PATTERN.sub("", cleaned)
+    cleaned = SPACE_PATTERN.sub(" ", cleaned)
+    cleaned = BLANK_LINES_PATTERN.sub("\n\n", cleaned)
+    cleaned = "\n".join(line.strip() for line in cleaned.split("\n")).strip()
+    return cleaned or text.strip()
+
+
+def hash_texts(texts):
+    """content_hash of each text; runs in the pool's worker processes"""
+    return [content_hash(text) for text in texts]
+
+
+def preprocess_texts(texts):
+    """
+    (content_hash, normalized text truncated to PROMPT_MAX_CONTENT_TOKENS,
+    its tokens, tokens truncated) of each text; runs in the pool's worker
+    processes
+    """
+    budget = PromptBudget()
+    records = []
+    for text in texts:
+        normalized, removed = budget.truncate_content(normalize_text(text))
+        records.append(
+            (content_hash(text), normalized, count_tokens(normalized), removed)
+        )
+    return records
+
+
+class Preprocessor:
+    """
+    CPU-bound text work (hashing, markdown cleanup, tokenizing) on a pool
+    of worker processes, so it neither holds the GIL of the threads doing
+    network I/O nor waits behind them.
+
+    Texts go to the workers in chunks of chunk_size. With a single worker,
+    or fewer than min_rows texts, the work runs inline instead: below that
+    size pickling the texts costs more than the work itself. The pool is
+    started on first use with the multiprocessing start method from
+    PREPROCESS_START_METHOD (default forkserver, or spawn where forkserver
+    is unavailable). The pool is created while scrape and analysis threads
+    are running and may hold logging, SQLite or tokenizer locks, so its
+    workers must not be forked from this process: a child could inherit
+    one of those locks held and deadlock.
+    """
+
+    def __init__(self, max_workers=None, chunk_size=None, min_rows=None):
+        self.max_workers = max_workers or int(
+            os.getenv("PREPROCESS_WORKERS", str(os.cpu_count() or 1))
+        )
+        self.chunk_size = chunk_size or int(os.getenv("PREPROCESS_CHUNK_SIZE", "2000"))
+        if min_rows is None:
+            min_rows = int(os.getenv("PREPROCESS_MIN_ROWS", "5000"))
+        self.min_rows = min_rows
+        self.executor = None
+        self.lock = threading.Lock()
+
+    @property
+    def parallel(self):
+        return self.max_workers > 1
+
+    def _pool(self):
+        with self.lock:
+            if self.executor is None:
+                start_method = os.getenv("PREPROCESS_START_METHOD") or (
+                    "forkserver"
+                    if "forkserver" in multiprocessing.get_all_start_methods()
+                    else "spawn"
+                )
+                context = multiprocessing.get_context(start_method)
+                if start_method == "forkserver":
+                    # Workers fork from a server that imported this module
+                    # once, not from the caller's threads
+                    context.set_forkserver_preload([__name__])
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=context
+                )
+            return self.executor
+
+    def submit(self, func, texts):
+        """
+        Run func(texts) in a worker process, or inline with a single worker.
+
+        Returns:
+            Future: Resolves to func's result
+        """
+        if not self.parallel:
+            future = Future()
+            future.set_result(func(list(texts)))
+            return future
+        return self._pool().submit(func, list(texts))
+
+    def map(self, func, texts):
+        """
+        Apply a per-chunk func such as preprocess_texts to texts, chunk by
+        chunk on the pool.
+
+        Returns:
+            list: func's results of every chunk, concatenated in input order
+        """
+        texts = list(texts)
+        if not self.parallel or len(texts) < self.min_rows:
+            return func(texts)
+        chunks = [
+            texts[i : i + self.chunk_size]
+            for i in range(0, len(texts), self.chunk_size)
+        ]
+        results = []
+        for chunk_result in self._pool().map(func, chunks):
+            results.extend(chunk_result)
+        return results
+
+    def preprocess(self, contents):
+        """
+        Hash, normalize, truncate and count the tokens of comment bodies.
+
+        Args:
+            contents (Series): Comment bodies
+
+        Returns:
+            DataFrame: comment_hash, text (normalized and truncated),
+            tokens and truncated_tokens columns, with the index of contents
+        """
+        records = self.map(preprocess_texts, contents.tolist())
+        return pd.DataFrame(
+            records,
+            index=contents.index,
+            columns=["comment_hash", "text", "tokens", "truncated_tokens"],
+        )
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+_preprocessor = None
+_preprocessor_lock = threading.Lock()
+
+
+def get_preprocessor():
+    """Return the process-wide Preprocessor, configured from the environment"""
+    global _preprocessor
+    with _preprocessor_lock:
+        if _preprocessor is None:
+            _preprocessor = Preprocessor()
+        return _preprocessor
@@ -0,0 +1,260 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from dotenv import load_dotenv
+
+from instrumentation import get_logger, get_metrics
+from token_budget import count_tokens
+
+load_dotenv()
+
+logger = get_logger(__name__)
+metrics = get_metrics()
+
+
+def estimate_tokens(text):
+    """Token count of text used for rate budgeting, see token_budget.count_tokens"""
+    return count_tokens(text)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate_per_second)
+        self.updated_at = now
+
+    def acquire(self, amount=1):
+        """Block until amount tokens are available, then take them"""
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate_per_second
+            time.sleep(wait)
+
+    def adjust(self, amount):
+        """Debit (positive) or credit (negative) tokens after the fact"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Caps the number of requests in flight and adapts the cap to the API's
+    responses: additive increase after a run of successes, multiplicative
+    decrease whenever a request is throttled (429) or fails server side (5xx).
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, increase_every=10):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase_every = increase_every
+        self.in_flight = 0
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.successes = 0
+                self.limit = max(self.minimum, self.limit // 2)
+            else:
+                self.successes += 1
+                if self.successes >= self.increase_every:
+                    self.successes = 0
+                    self.limit = min(self.maximum, self.limit + 1)
+            self.condition.notify_all()
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def _retryable(status):
+    """Client errors are final, except request timeouts (408) and 429s"""
+    return status is None or not 400 <= status < 500 or status in (408, 429)
+
+
+def _retry_after(error):
+    """Seconds to wait according to the error's Retry-After headers, if any"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMScheduler:
+    """
+    Client-side scheduler shared by every LLM caller in the pipeline.
+
+    Each call waits for the requests/min and tokens/min buckets and for a
+    free concurrency slot, and is retried with jittered exponential backoff
+    (or the server's Retry-After) when it fails. Client errors other than
+    408 and 429 (e.g. 400 context length, 401 auth) are not retried.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=60,
+        tokens_per_minute=100000,
+        max_concurrency=8,
+        max_retries=3,
+        base_delay=2,
+        max_delay=60,
+        name="llm",
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            initial=max(1, max_concurrency // 2), maximum=max_concurrency
+        )
+        self.max_retries = max_retries
+        # Label of this scheduler's retry and throttle counters
+        self.name = name
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _backoff(self, attempt, error):
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        # "Full jitter" backoff keeps parallel workers from retrying in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def call(self, request, estimated_tokens=0, parse=None):
+        """
+        Run request() under the rate limits and retry it on failure.
+
+        Args:
+            request (callable): Performs the API request and returns the response
+            estimated_tokens (int): Expected prompt + completion tokens
+            parse (callable): Optional parser applied to the response; parse
+                errors are retried like request errors
+
+        Returns:
+            The parsed response. Re-raises the last error once retries run
+            out, and non-retryable client errors at once.
+        """
+        for attempt in range(self.max_retries):
+            self.request_bucket.acquire()
+            self.token_bucket.acquire(estimated_tokens)
+            self.concurrency.acquire()
+            throttled = False
+            settled = False
+            try:
+                response = request()
+
+                # Settle the token budget against the reported usage
+                usage = getattr(response, "usage", None)
+                total_tokens = getattr(usage, "total_tokens", None)
+                if total_tokens is not None:
+                    self.token_bucket.adjust(total_tokens - estimated_tokens)
+                    settled = True
+
+                return parse(response) if parse else response
+            except Exception as e:
+                # A failed request reported no usage: give its tokens back
+                if not settled:
+                    self.token_bucket.adjust(-estimated_tokens)
+                status = _status_code(e)
+                throttled = status is not None and (status == 429 or status >= 500)
+                if throttled:
+                    metrics.incr("throttled_total", api=self.name, status=status)
+                if not _retryable(status):
+                    metrics.incr("failures_total", api=self.name)
+                    logger.error(f"Not retrying client error {status}: {str(e)}")
+                    raise
+                if attempt == self.max_retries - 1:
+                    metrics.incr("failures_total", api=self.name)
+                    logger.error(f"Failed after {self.max_retries} attempts: {str(e)}")
+                    raise
+
+                delay = self._backoff(attempt, e)
+                metrics.incr("retries_total", api=self.name)
+                logger.warning(
+                    f"Attempt {attempt + 1} failed: {str(e)}. "
+                    f"Retrying in {delay:.1f} seconds..."
+                )
+            finally:
+                self.concurrency.release(throttled=throttled)
+
+            # Back off without holding a concurrency slot
+            time.sleep(delay)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(shares=1):
+    """
+    Return the process-wide LLMScheduler, configured from the environment.
+
+    Args:
+        shares (int): Number of processes calling the API at the same time,
+            e.g. parallel DAG shards. Each gets an equal share of the
+            configured limits. Only used when the scheduler is first created.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            shares = max(1, shares)
+            _scheduler = LLMScheduler(
+                requests_per_minute=max(
+                    1, int(os.getenv("LLM_REQUESTS_PER_MINUTE", "60")) // shares
+                ),
+                tokens_per_minute=max(
+                    1, int(os.getenv("LLM_TOKENS_PER_MINUTE", "100000")) // shares
+                ),
+                max_concurrency=max(
+                    1, int(os.getenv("LLM_MAX_CONCURRENCY", "8")) // shares
+                ),
+            )
+        return _scheduler
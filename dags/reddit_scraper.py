@@ -5,43 +5,110 @@ import os
 from dotenv import load_dotenv
 from requests.exceptions import ReadTimeout
 from prawcore.exceptions import RequestException
-import hashlib
+import math
+import queue
+from collections import deque
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from rate_limiter import TokenBucket
+from scrape_state import ScrapeState
+from hash_store import HashStore
+from instrumentation import get_logger, get_metrics
+from preprocessing import content_hash, get_preprocessor, hash_texts
 
 load_dotenv()
 
+logger = get_logger(__name__)
+metrics = get_metrics()
+
+
+def parse_subreddit_config(config, hot_limit=10, new_limit=25):
+    """
+    Normalize a subreddit config into a list of dicts with name, hot_limit
+    and new_limit.
+
+    Accepts a list of names or dicts, or a comma separated string such as
+    "journaling:10:25,productivity" where the limits are optional.
+    """
+    if isinstance(config, str):
+        config = [entry.strip() for entry in config.split(",") if entry.strip()]
+
+    subreddits = []
+    for entry in config:
+        if isinstance(entry, dict):
+            subreddits.append(
+                {
+                    "name": entry["name"],
+                    "hot_limit": int(entry.get("hot_limit", hot_limit)),
+                    "new_limit": int(entry.get("new_limit", new_limit)),
+                }
+            )
+            continue
+
+        name, *limits = entry.split(":")
+        subreddits.append(
+            {
+                "name": name,
+                "hot_limit": int(limits[0]) if len(limits) > 0 else hot_limit,
+                "new_limit": int(limits[1]) if len(limits) > 1 else new_limit,
+            }
+        )
+    return subreddits
+
 
 class RedditScraper:
-    def __init__(self):
-        client_id = os.getenv("REDDIT_CLIENT_ID")
-        client_secret = os.getenv("REDDIT_CLIENT_SECRET")
-        username = os.getenv("REDDIT_USERNAME")
-        password = os.getenv("REDDIT_PASSWORD")
-
-        self.reddit = praw.Reddit(
-            client_id=client_id,
-            client_secret=client_secret,
-            username=username,
-            timeout=100,
-            password=password,
-            user_agent="script:reddit_scraper:v1.0 (by /u/ClassicStruggle6185)",
+    def __init__(self, state=None, reddit_factory=None):
+        # reddit_factory builds the praw.Reddit-like clients, e.g. a local
+        # stand-in when benchmarking; defaults to the configured PRAW client
+        self._reddit_factory = reddit_factory or self._build_reddit
+        self.reddit = self._reddit_factory()
+        # High-water marks used to skip submissions without new comments
+        self.state = state if state is not None else ScrapeState()
+
+        # PRAW instances are not thread-safe, so scrape workers each get their
+        # own, all drawing from one shared request budget (Reddit allows ~100
+        # OAuth requests per minute per client)
+        self._local = threading.local()
+        self.request_budget = TokenBucket(
+            int(os.getenv("REDDIT_REQUESTS_PER_MINUTE", "100"))
         )
+        self.last_scrape_report = {}
+        # scrape_subreddits hashes comment bodies on this process pool
+        self.preprocessor = get_preprocessor()
 
         # Test authentication
         try:
-            print("Testing authentication...")
-            print(f"Read-only: {self.reddit.read_only}")
+            logger.info("Testing authentication...")
+            logger.info(f"Read-only: {self.reddit.read_only}")
 
-            print(f"User agent: {self.reddit.config.user_agent}")
+            logger.info(f"User agent: {self.reddit.config.user_agent}")
             # Try to access something simple
-            print("Attempting to access Reddit...")
+            logger.info("Attempting to access Reddit...")
             self.reddit.user.me()
-            print("Authentication successful!")
+            logger.info("Authentication successful!")
         except Exception as e:
-            print(f"Authentication failed: {str(e)}")
+            logger.warning(f"Authentication failed: {str(e)}")
+
+    def _build_reddit(self):
+        return praw.Reddit(
+            client_id=os.getenv("REDDIT_CLIENT_ID"),
+            client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
+            username=os.getenv("REDDIT_USERNAME"),
+            timeout=100,
+            password=os.getenv("REDDIT_PASSWORD"),
+            user_agent="script:reddit_scraper:v1.0 (by /u/ClassicStruggle6185)",
+        )
+
+    def _thread_reddit(self):
+        """Reddit client owned by the calling worker thread"""
+        if not hasattr(self._local, "reddit"):
+            self._local.reddit = self._reddit_factory()
+        return self._local.reddit
 
     def generate_hash(self, text):
         """Generate SHA-256 hash of text"""
-        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return content_hash(text)
 
     def check_duplicates(self, df, new_comments):
         """Check for duplicates using comment hashes"""
@@ -55,10 +122,81 @@ class RedditScraper:
             if comment["comment_hash"] not in existing_hashes
         ]
 
-    def scrape_subreddit_comments(self, subreddit_name, hot_limit=10, new_limit=25):
-        """Scrape top comments from both hot and new posts with different limits"""
-        subreddit = self.reddit.subreddit(subreddit_name)
-        comments = []
+    def scrape_subreddit_comments(
+        self,
+        subreddit_name,
+        hot_limit=10,
+        new_limit=25,
+        reddit=None,
+        stats=None,
+        incremental=True,
+    ):
+        """Scrape top comments from both hot and new posts into a list, see
+        iter_subreddit_comments for the arguments"""
+        return list(
+            self.iter_subreddit_comments(
+                subreddit_name,
+                hot_limit=hot_limit,
+                new_limit=new_limit,
+                reddit=reddit,
+                stats=stats,
+                incremental=incremental,
+            )
+        )
+
+    def iter_subreddit_comments(
+        self,
+        subreddit_name,
+        hot_limit=10,
+        new_limit=25,
+        reddit=None,
+        stats=None,
+        incremental=True,
+        batch_size=None,
+        hash_comments=True,
+    ):
+        """
+        Stream top comments from both hot and new posts with different limits.
+
+        Comments are yielded as soon as their submission has been processed,
+        so only one submission's comments are held in memory at a time.
+
+        Args:
+            subreddit_name (str): Subreddit to scrape
+            hot_limit (int): Number of hot submissions
+            new_limit (int): Number of new submissions
+            reddit (praw.Reddit): Client to use, defaults to self.reddit
+            stats (dict): Optional counters, "errors" is incremented for every
+                submission that fails and "skipped" for every unchanged one
+            incremental (bool): Stop paging the new listing at the newest
+                submission an earlier run saw, skip submissions whose comment
+                count matches the scrape state, and only return comments newer
+                than the last fetch of a changed submission. Older threads that
+                are still active come from the hot listing. Call
+                self.state.flush() once the returned comments are saved.
+            batch_size (int): Yield lists of up to batch_size comments instead
+                of single comments; a batch never spans two submissions
+            hash_comments (bool): Compute each comment_hash here; when False
+                it is left None for the caller to fill in, as
+                scrape_subreddits does on the preprocessing pool
+
+        Yields:
+            dict, or list of dicts when batch_size is set
+        """
+        subreddit = (reddit or self.reddit).subreddit(subreddit_name)
+        seen_submissions = set()
+        newest_submission_utc = 0
+        subreddit_state = (
+            self.state.get_subreddit(subreddit_name) if incremental else None
+        )
+        last_seen_utc = (
+            subreddit_state["last_seen_created_utc"] if subreddit_state else None
+        )
+
+        # Listings are fetched in pages of up to 100 submissions
+        self.request_budget.acquire(
+            math.ceil(hot_limit / 100) + math.ceil(new_limit / 100)
+        )
 
         try:
             # Scrape with different limits for hot and new
@@ -69,21 +207,75 @@ class RedditScraper:
 
             for post_type, submission_stream in submission_streams:
                 for submission in submission_stream:
+                    # The new listing is newest first, so the rest of it was
+                    # listed by an earlier run
+                    if (
+                        post_type == "new"
+                        and last_seen_utc
+                        and submission.created_utc <= last_seen_utc
+                    ):
+                        break
+
+                    # Hot and new listings often overlap
+                    if submission.id in seen_submissions:
+                        continue
+                    seen_submissions.add(submission.id)
+                    newest_submission_utc = max(
+                        newest_submission_utc, submission.created_utc
+                    )
+
+                    # num_comments comes with the listing, so checking it is free
+                    previous = (
+                        self.state.get_submission(submission.id)
+                        if incremental
+                        else None
+                    )
+                    if (
+                        previous is not None
+                        and previous["num_comments"] == submission.num_comments
+                    ):
+                        if stats is not None:
+                            stats["skipped"] = stats.get("skipped", 0) + 1
+                        metrics.incr(
+                            "reddit_submissions_total",
+                            subreddit=subreddit_name,
+                            outcome="unchanged",
+                        )
+                        continue
+                    since_utc = previous["last_comment_utc"] if previous else 0
+
+                    comments = []
                     try:
-                        submission.comments.replace_more(limit=0)
+                        # One request for the comment tree
+                        self.request_budget.acquire()
+                        with metrics.span("reddit_request", endpoint="comments"):
+                            submission.comments.replace_more(limit=0)
 
                         # Generate hash for post
                         post_hash = self.generate_hash(
                             submission.title + submission.selftext
                         )
 
+                        last_comment_utc = since_utc or 0
                         for comment in submission.comments.list():
+                            last_comment_utc = max(
+                                last_comment_utc, comment.created_utc
+                            )
+
                             # Skip AutoModerator
                             if comment.author == "AutoModerator":
                                 continue
 
+                            # Already returned by an earlier run
+                            if comment.created_utc <= since_utc:
+                                continue
+
                             # Generate hash for comment
-                            comment_hash = self.generate_hash(comment.body)
+                            comment_hash = (
+                                self.generate_hash(comment.body)
+                                if hash_comments
+                                else None
+                            )
 
                             comments.append(
                                 {
@@ -109,61 +301,219 @@ class RedditScraper:
                                 }
                             )
 
+                        self.state.record_submission(
+                            submission.id,
+                            subreddit_name,
+                            submission.num_comments,
+                            last_comment_utc,
+                        )
+
                     except Exception as e:
-                        print(f"Error processing submission {submission.id}: {str(e)}")
+                        logger.error(
+                            f"Error processing submission {submission.id}: {str(e)}"
+                        )
+                        if stats is not None:
+                            stats["errors"] = stats.get("errors", 0) + 1
+                        metrics.incr(
+                            "reddit_submissions_total",
+                            subreddit=subreddit_name,
+                            outcome="error",
+                        )
                         continue
 
+                    metrics.incr(
+                        "reddit_submissions_total",
+                        subreddit=subreddit_name,
+                        outcome="fetched",
+                    )
+                    metrics.incr(
+                        "rows_processed_total",
+                        len(comments),
+                        stage="scrape",
+                        outcome="scraped",
+                    )
+
+                    if stats is not None:
+                        stats["comments"] = stats.get("comments", 0) + len(comments)
+                    if batch_size:
+                        for i in range(0, len(comments), batch_size):
+                            yield comments[i : i + batch_size]
+                    else:
+                        yield from comments
+
         except Exception as e:
-            print(f"Error occurred while scraping comments: {str(e)}")
+            logger.error(f"Error occurred while scraping comments: {str(e)}")
             raise
 
-        return comments
-
-
-def main():
-    scraper = RedditScraper()
-    subreddit_name = "journaling"
+        if newest_submission_utc:
+            self.state.record_subreddit(subreddit_name, newest_submission_utc)
 
+    def _scrape_worker(self, config, output, batch_size, stop):
+        """Stream one subreddit's comment batches into the output queue, then
+        put a (name, stats) marker"""
+        stats = {"comments": 0, "errors": 0, "skipped": 0}
+        started_at = time.perf_counter()
+        try:
+            for batch in self.iter_subreddit_comments(
+                config["name"],
+                hot_limit=config["hot_limit"],
+                new_limit=config["new_limit"],
+                reddit=self._thread_reddit(),
+                stats=stats,
+                batch_size=batch_size,
+                hash_comments=False,
+            ):
+                if stop.is_set():
+                    break
+                output.put(batch)
+        except Exception:
+            stats["errors"] += 1
+        finally:
+            stats["seconds"] = round(time.perf_counter() - started_at, 2)
+            output.put((config["name"], stats))
+
+    def scrape_subreddits(self, subreddits, max_workers=None, batch_size=100):
+        """
+        Scrape several subreddits concurrently under the shared request budget.
+
+        Args:
+            subreddits: List of names or dicts (name, hot_limit, new_limit), or
+                a config string, see parse_subreddit_config
+            max_workers (int): Number of subreddits scraped at once
+            batch_size (int): Comments handed over from workers at a time
+
+        Yields:
+            dict: Comment records, merged from all subreddits as each
+            submission is processed. Workers block while the consumer is
+            behind, so memory stays bounded. Per subreddit timings, comment,
+            skip and error counts end up in last_scrape_report.
+
+        Comment bodies are hashed batch by batch on the preprocessing pool,
+        with a few batches in flight, while the workers keep fetching.
+        """
+        configs = parse_subreddit_config(subreddits)
+        max_workers = max_workers or int(os.getenv("REDDIT_MAX_WORKERS", "4"))
+        self.last_scrape_report = {}
+        output = queue.Queue(maxsize=max_workers * 2)
+        stop = threading.Event()
+        # (batch, future of its comment hashes), in the order received
+        hashing = deque()
+        max_hashing = max(2, self.preprocessor.max_workers * 2)
+
+        def hashed(batch, future):
+            for comment, comment_hash in zip(batch, future.result()):
+                comment["comment_hash"] = comment_hash
+            return batch
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._scrape_worker, config, output, batch_size, stop)
+                for config in configs
+            ]
 
-    hot_limit = 10  # Top 10 hot posts
-    new_limit = 25  # Top 25 new posts since these rotate more frequently
+            try:
+                remaining = len(configs)
+                while remaining:
+                    item = output.get()
+                    if isinstance(item, list):
+                        hashing.append(
+                            (
+                                item,
+                                self.preprocessor.submit(
+                                    hash_texts, [c["content"] for c in item]
+                                ),
+                            )
+                        )
+                        while hashing and (
+                            len(hashing) > max_hashing or hashing[0][1].done()
+                        ):
+                            yield from hashed(*hashing.popleft())
+                        continue
 
-    try:
-        # Load existing data if available
+                    name, stats = item
+                    remaining -= 1
+                    self.last_scrape_report[name] = stats
+                    logger.info(
+                        f"r/{name}: {stats['comments']} comments in "
+                        f"{stats['seconds']}s, {stats['errors']} errors, "
+                        f"{stats['skipped']} unchanged submissions skipped"
+                    )
+                while hashing:
+                    yield from hashed(*hashing.popleft())
+            finally:
+                # The consumer stopped early: unblock the workers so they exit
+                stop.set()
+                while not all(future.done() for future in futures):
+                    try:
+                        output.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+
+def save_new_comments(hash_store, comments):
+    """
+    Append the comments not yet in the hash store to their subreddit's CSV,
+    then record their hashes. Returns the number of comments added.
+    """
+    unique_comments = hash_store.filter_new(comments)
+    by_subreddit = {}
+    for comment in unique_comments:
+        by_subreddit.setdefault(comment["subreddit"], []).append(comment)
+
+    for subreddit_name, subreddit_comments in by_subreddit.items():
         output_file = f"reddit_comments_{subreddit_name}.csv"
-        try:
-            existing_df = pd.read_csv(output_file)
-        except FileNotFoundError:
-            existing_df = pd.DataFrame()
-
-        # Scrape new comments with adjusted limits
-        print(f"Scraping comments from r/{subreddit_name}...")
-        new_comments = scraper.scrape_subreddit_comments(
-            subreddit_name, hot_limit=hot_limit, new_limit=new_limit
-        )
+        new_df = pd.DataFrame(subreddit_comments)
+
+        # Append in the existing file's column order instead of rewriting it
+        if os.path.exists(output_file):
+            columns = pd.read_csv(output_file, nrows=0).columns
+            new_df.reindex(columns=columns).to_csv(
+                output_file, mode="a", header=False, index=False
+            )
+        else:
+            new_df.to_csv(output_file, index=False)
+        logger.info(f"Added {len(subreddit_comments)} new comments to {output_file}")
+
+    hash_store.add(unique_comments)
+    return len(unique_comments)
 
-        # Check for duplicates
-        unique_comments = scraper.check_duplicates(existing_df, new_comments)
 
-        if unique_comments:
-            # Create DataFrame with new unique comments
-            new_df = pd.DataFrame(unique_comments)
+def main():
+    scraper = RedditScraper()
+    hash_store = HashStore()
+    subreddits = os.getenv("REDDIT_SUBREDDITS", "journaling")
 
-            # Combine with existing data
-            if not existing_df.empty:
-                df = pd.concat([existing_df, new_df], ignore_index=True)
-            else:
-                df = new_df
+    # Defaults: top 10 hot posts, top 25 new posts since these rotate more
+    # frequently. Override per subreddit as name:hot_limit:new_limit.
+    configs = parse_subreddit_config(subreddits, hot_limit=10, new_limit=25)
 
-            # Save to CSV
-            df.to_csv(output_file, index=False)
-            print(f"\nResults saved to {output_file}")
-            print(f"Added {len(unique_comments)} new comments")
-        else:
-            print("No new comments to add")
+    # Import the hashes of CSVs written before the hash store existed
+    for config in configs:
+        seeded = hash_store.seed_from_csv(f"reddit_comments_{config['name']}.csv")
+        if seeded:
+            logger.info(
+                f"Seeded hash store with {seeded} hashes from r/{config['name']}"
+            )
 
+    try:
+        logger.info(f"Scraping comments from {len(configs)} subreddits...")
+        added = 0
+        buffer = []
+        for comment in scraper.scrape_subreddits(configs):
+            buffer.append(comment)
+            if len(buffer) >= 500:
+                added += save_new_comments(hash_store, buffer)
+                buffer = []
+        added += save_new_comments(hash_store, buffer)
     except Exception as e:
-        print(f"Error occurred: {str(e)}")
+        logger.error(f"Error occurred: {str(e)}")
+        return
+
+    if not added:
+        logger.info("No new comments to add")
+
+    # Only advance the high-water marks once the comments are saved
+    scraper.state.flush()
 
 
 if __name__ == "__main__":
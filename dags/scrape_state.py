@@ -0,0 +1,160 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class ScrapeState:
+    """
+    Persisted high-water marks for incremental scraping.
+
+    Per subreddit it keeps the newest submission created_utc seen and the last
+    fetch time; per submission the comment count, newest comment created_utc
+    and last fetch time. The new listing is only paged down to the newest
+    submission already seen, and submissions whose comment count hasn't
+    changed since the last run are skipped without expanding their comment
+    tree.
+
+    Updates are buffered until flush() so that callers can persist the state
+    only after the scraped comments themselves have been saved. When that
+    happens in another process, e.g. a later DAG task, save_pending() hands
+    the buffered updates over through a file and load_pending() picks them up.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("SCRAPE_STATE_PATH", "scrape_state.sqlite3")
+        self.lock = threading.Lock()
+        self.pending_subreddits = {}
+        self.pending_submissions = {}
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS subreddit_state (
+                subreddit TEXT PRIMARY KEY,
+                last_seen_created_utc REAL,
+                last_fetch_at REAL
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS submission_state (
+                submission_id TEXT PRIMARY KEY,
+                subreddit TEXT,
+                num_comments INTEGER,
+                last_comment_utc REAL,
+                last_fetch_at REAL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def get_subreddit(self, subreddit):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT last_seen_created_utc, last_fetch_at FROM subreddit_state "
+                "WHERE subreddit = ?",
+                (subreddit,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"last_seen_created_utc": row[0], "last_fetch_at": row[1]}
+
+    def get_submission(self, submission_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT num_comments, last_comment_utc, last_fetch_at "
+                "FROM submission_state WHERE submission_id = ?",
+                (submission_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "num_comments": row[0],
+            "last_comment_utc": row[1],
+            "last_fetch_at": row[2],
+        }
+
+    def record_subreddit(self, subreddit, last_seen_created_utc):
+        with self.lock:
+            previous = self.pending_subreddits.get(subreddit, (0, 0))[0]
+            self.pending_subreddits[subreddit] = (
+                max(previous, last_seen_created_utc),
+                time.time(),
+            )
+
+    def record_submission(
+        self, submission_id, subreddit, num_comments, last_comment_utc
+    ):
+        with self.lock:
+            self.pending_submissions[submission_id] = (
+                subreddit,
+                num_comments,
+                last_comment_utc,
+                time.time(),
+            )
+
+    def flush(self):
+        """Persist buffered updates, keeping the highest high-water marks"""
+        with self.lock:
+            self.conn.executemany(
+                """
+                INSERT INTO subreddit_state
+                (subreddit, last_seen_created_utc, last_fetch_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (subreddit) DO UPDATE SET
+                    last_seen_created_utc = MAX(
+                        COALESCE(last_seen_created_utc, 0),
+                        excluded.last_seen_created_utc
+                    ),
+                    last_fetch_at = excluded.last_fetch_at
+                """,
+                [(name,) + values for name, values in self.pending_subreddits.items()],
+            )
+            self.conn.executemany(
+                """
+                INSERT OR REPLACE INTO submission_state
+                (submission_id, subreddit, num_comments, last_comment_utc,
+                 last_fetch_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [
+                    (submission_id,) + values
+                    for submission_id, values in self.pending_submissions.items()
+                ],
+            )
+            self.conn.commit()
+            self.pending_subreddits = {}
+            self.pending_submissions = {}
+
+    def save_pending(self, path):
+        """
+        Move the buffered updates to a JSON file instead of persisting them.
+        The file is replaced atomically, so a retried task overwrites it.
+        """
+        with self.lock:
+            data = {
+                "subreddits": self.pending_subreddits,
+                "submissions": self.pending_submissions,
+            }
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(path + ".tmp", path)
+            self.pending_subreddits = {}
+            self.pending_submissions = {}
+
+    def load_pending(self, path):
+        """Buffer the updates saved by save_pending(); flush() persists them"""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for subreddit, (last_seen_created_utc, _) in data["subreddits"].items():
+            self.record_subreddit(subreddit, last_seen_created_utc)
+        with self.lock:
+            for submission_id, values in data["submissions"].items():
+                self.pending_submissions[submission_id] = tuple(values)
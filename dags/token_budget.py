@@ -0,0 +1,219 @@
+import math
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+
+from instrumentation import get_logger, get_metrics
+
+load_dotenv()
+
+logger = get_logger(__name__)
+metrics = get_metrics()
+
+# Inserted where the middle of an over-long text was cut out
+TRUNCATION_MARKER = "\n[...]\n"
+
+# Share of a truncated text's budget kept from its beginning; the rest
+# comes from its end, where comments often state their conclusion
+TRUNCATION_HEAD_SHARE = 0.7
+
+PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """
+    tiktoken encoding named by TOKENIZER_ENCODING (default cl100k_base), or
+    None when tiktoken is not installed or the encoding cannot be loaded
+    (it is downloaded on first use). Tried once per process.
+    """
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            name = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+            try:
+                import tiktoken
+
+                _encoding = tiktoken.get_encoding(name)
+            except ImportError:
+                pass
+            except Exception as e:
+                logger.warning(
+                    f"Could not load tokenizer {name}, estimating tokens: {e}"
+                )
+        return _encoding
+
+
+def count_tokens(text):
+    """
+    Tokens in text by the local tokenizer. Without tiktoken, each word
+    counts one token per 4 characters (rounded up) and each punctuation
+    mark one token, which slightly overestimates English text.
+    """
+    text = str(text)
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return sum(math.ceil(len(piece) / 4) for piece in PIECE_PATTERN.findall(text))
+
+
+def _prefix_end(text, max_tokens):
+    """End of the longest prefix of text within max_tokens, cut at whitespace"""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    if low < len(text):
+        space = max(text.rfind(" ", 0, low + 1), text.rfind("\n", 0, low + 1))
+        if space > 0:
+            low = space
+    return low
+
+
+def _suffix_start(text, max_tokens):
+    """Start of the longest suffix of text within max_tokens, cut at whitespace"""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high) // 2
+        if count_tokens(text[middle:]) <= max_tokens:
+            high = middle
+        else:
+            low = middle + 1
+    if low > 0:
+        spaces = [i for i in (text.find(" ", low), text.find("\n", low)) if i >= 0]
+        if spaces:
+            low = min(spaces) + 1
+    return low
+
+
+def truncate_text(text, max_tokens):
+    """
+    Cut the middle out of a text longer than max_tokens, keeping its
+    beginning and end.
+
+    Returns:
+        tuple: (text within max_tokens, number of tokens removed)
+    """
+    text = str(text)
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text, 0
+
+    budget = max(0, max_tokens - count_tokens(TRUNCATION_MARKER))
+    head_budget = int(budget * TRUNCATION_HEAD_SHARE)
+    while True:
+        head_end = _prefix_end(text, head_budget)
+        tail_start = max(head_end, _suffix_start(text, budget - head_budget))
+        truncated = (
+            text[:head_end].rstrip() + TRUNCATION_MARKER + text[tail_start:].lstrip()
+        )
+        # Tokens can merge across the joins, so check the result
+        if count_tokens(truncated) <= max_tokens or budget <= 0:
+            break
+        budget -= 1
+        head_budget = int(budget * TRUNCATION_HEAD_SHARE)
+    return truncated, tokens - count_tokens(truncated)
+
+
+def chunk_items(items, max_tokens, max_items=None):
+    """
+    Split texts into consecutive chunks of at most max_tokens tokens (and
+    max_items items). An item larger than max_tokens gets a chunk of its own.
+
+    Returns:
+        list: Lists of items
+    """
+    chunks = []
+    chunk = []
+    chunk_tokens = 0
+    for item in items:
+        tokens = count_tokens(item)
+        if chunk and (
+            chunk_tokens + tokens > max_tokens
+            or (max_items and len(chunk) >= max_items)
+        ):
+            chunks.append(chunk)
+            chunk = []
+            chunk_tokens = 0
+        chunk.append(item)
+        chunk_tokens += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class PromptTooLarge(ValueError):
+    """A prompt exceeds PROMPT_MAX_TOKENS and would not fit the context window"""
+
+
+class PromptBudget:
+    """
+    Token limits applied before a prompt is sent.
+
+    Comment text above max_content_tokens and list items above
+    max_item_tokens are truncated (see truncate_text); whole prompts above
+    max_prompt_tokens are refused, instead of failing at the API after every
+    retry. record() counts the tokens of each prompt per prompt kind.
+    """
+
+    def __init__(
+        self, max_content_tokens=None, max_item_tokens=None, max_prompt_tokens=None
+    ):
+        self.max_content_tokens = max_content_tokens or int(
+            os.getenv("PROMPT_MAX_CONTENT_TOKENS", "1500")
+        )
+        self.max_item_tokens = max_item_tokens or int(
+            os.getenv("PROMPT_MAX_ITEM_TOKENS", "60")
+        )
+        self.max_prompt_tokens = max_prompt_tokens or int(
+            os.getenv("PROMPT_MAX_TOKENS", "16000")
+        )
+
+    def truncate_content(self, text):
+        """(text within max_content_tokens, tokens removed); records nothing"""
+        return truncate_text(text, self.max_content_tokens)
+
+    def fit(self, kind, text, max_tokens=None):
+        """
+        Truncate text to max_tokens (default max_content_tokens) and count
+        the truncation under the prompt kind.
+        """
+        text, removed = truncate_text(text, max_tokens or self.max_content_tokens)
+        if removed:
+            self.record_truncation(kind, 1, removed)
+        return text
+
+    def record_truncation(self, kind, texts, removed_tokens):
+        metrics.incr("prompt_truncations_total", texts, prompt=kind)
+        metrics.incr("prompt_tokens_truncated_total", removed_tokens, prompt=kind)
+
+    def record(self, kind, prompt):
+        """
+        Count a prompt about to be sent.
+
+        Returns:
+            int: Its tokens
+
+        Raises:
+            PromptTooLarge: The prompt exceeds max_prompt_tokens
+        """
+        tokens = count_tokens(prompt)
+        metrics.incr("prompts_total", prompt=kind)
+        metrics.incr("prompt_tokens_total", tokens, prompt=kind)
+        logger.debug("%s prompt: %d tokens", kind, tokens)
+        if tokens > self.max_prompt_tokens:
+            metrics.incr("prompts_refused_total", prompt=kind)
+            raise PromptTooLarge(
+                f"{kind} prompt has {tokens} tokens, over the "
+                f"{self.max_prompt_tokens} token limit"
+            )
+        return tokens